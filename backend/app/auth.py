@@ -1,10 +1,12 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.responses import RedirectResponse
-import requests
+from app.services import http_client
 from urllib.parse import urlencode
 from app.config import settings
-from app.database import SessionLocal
+from app.database import SessionLocal, get_db
+from sqlalchemy.ext.asyncio import AsyncSession
 from app import models, security
+from app.services.user_cache import user_cache, CachedUser
 import traceback
 from loguru import logger
 
@@ -46,7 +48,7 @@ def google_oauth_callback(code: str = None, error: str = None):
     }
     
     logger.debug("Exchanging authorization code for tokens")
-    token_resp = requests.post(GOOGLE_TOKEN_URL, data=token_data)
+    token_resp = http_client.post(GOOGLE_TOKEN_URL, data=token_data)
     
     if token_resp.status_code != 200:
         logger.error(f"Token exchange failed: {token_resp.status_code} - {token_resp.text}")
@@ -64,7 +66,7 @@ def google_oauth_callback(code: str = None, error: str = None):
         logger.warning("No refresh token in response - user may have previously authorized this app")
         # Continue without refresh token - will use existing one if available
     
-    userinfo_resp = requests.get(GOOGLE_USERINFO_URL, headers={"Authorization": f"Bearer {access_token}"})
+    userinfo_resp = http_client.get(GOOGLE_USERINFO_URL, headers={"Authorization": f"Bearer {access_token}"})
     
     if userinfo_resp.status_code != 200:
         logger.error(f"Failed to get user info: {userinfo_resp.status_code} - {userinfo_resp.text}")
@@ -76,7 +78,14 @@ def google_oauth_callback(code: str = None, error: str = None):
     
     logger.info(f"Successfully authenticated user: {email}")
     
-    db = SessionLocal()
+    with SessionLocal() as db:
+        user, jwt_token = _save_oauth_user(db, email, name, access_token, refresh_token)
+
+    redirect_url = f"{settings.FRONTEND_URL}/auth/callback?token={jwt_token}"
+    return RedirectResponse(redirect_url)
+
+def _save_oauth_user(db, email: str, name: str, access_token: str, refresh_token: str):
+    """Create or update the user after a successful OAuth exchange; returns (user, JWT)."""
     user = db.query(models.User).filter_by(email=email).first()
     
     if not user:
@@ -95,7 +104,7 @@ def google_oauth_callback(code: str = None, error: str = None):
         try:
             # Verify token works by making a simple API call
             logger.info("Verifying token with test API call")
-            test_token_resp = requests.get(
+            test_token_resp = http_client.get(
                 "https://gmail.googleapis.com/gmail/v1/users/me/profile",
                 headers={"Authorization": f"Bearer {access_token}"}
             )
@@ -107,16 +116,13 @@ def google_oauth_callback(code: str = None, error: str = None):
             logger.error(f"Error during token verification: {str(e)}")
     
     db.commit()
-    jwt_token = security.create_jwt_token(user_id=user.id)
-    db.close()
-    
-    redirect_url = f"{settings.FRONTEND_URL}/auth/callback?token={jwt_token}"
-    return RedirectResponse(redirect_url)
+    user_cache.invalidate(user.id)
+    return user, security.create_jwt_token(user_id=user.id)
 
 from fastapi.security import HTTPBearer
 auth_scheme = HTTPBearer(auto_error=False)
 
-def get_current_user(token: str = Depends(auth_scheme)):
+async def get_current_user(token: str = Depends(auth_scheme), db: AsyncSession = Depends(get_db)) -> CachedUser:
     if not token or not token.credentials:
         raise HTTPException(status_code=401, detail="Not authenticated")
     try:
@@ -124,15 +130,18 @@ def get_current_user(token: str = Depends(auth_scheme)):
         user_id = payload.get("sub")
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
-        
-        db = SessionLocal()
-        try:
-            user = db.query(models.User).get(user_id)
-            if not user:
-                raise HTTPException(status_code=401, detail="User not found")
-            return user
-        finally:
-            db.close()
+        user_id = int(user_id)
+
+        cached = user_cache.get(user_id)
+        if cached is not None:
+            # The session has not checked out a connection yet, so a hit never touches the pool
+            return cached
+        user = await db.get(models.User, user_id)
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        cached = CachedUser(id=user.id, email=user.email, name=user.name)
+        user_cache.put(cached)
+        return cached
     except Exception as e:
         logger.error(f"Authentication error: {str(e)}")
         logger.error(traceback.format_exc())
@@ -24,6 +24,75 @@ class Settings(BaseSettings):
     AZURE_BLOB_CONTAINER: str
     FRONTEND_URL: str
     KEY_VAULT_URL: str
+    GMAIL_SYNC_PAGE_SIZE: int = 100
+    GMAIL_SYNC_MAX_MESSAGES: int = 500
+    GMAIL_BATCH_SIZE: int = 50
+    GMAIL_ATTACHMENT_BATCH_SIZE: int = 10
+    ACCESS_TOKEN_TTL_MARGIN: int = 300  # Seconds before expiry to stop reusing a cached access token
+    ACCESS_TOKEN_LOCK_WAIT: int = 35
+    EXTRACTION_CACHE_BACKEND: str = "memory"  # "memory", "disk", "redis" or "none"
+    EXTRACTION_CACHE_MAX_BYTES: int = 64 * 1024 * 1024
+    EXTRACTION_CACHE_DIR: str = "/tmp/billstracker-cache"
+    EXTRACTION_CACHE_TTL: int = 30 * 24 * 3600
+    AZURE_OPENAI_TPM: int = 8000  # Deployment quota, shared by all workers
+    AZURE_OPENAI_RPM: int = 48
+    AZURE_OPENAI_RATE_LIMIT_MAX_WAIT: float = 120.0
+    TOKENIZER_ENCODING: str = "cl100k_base"
+    LLM_BATCH_PROMPT_TOKENS: int = 6000  # Safe threshold under 8000 tokens/minute limit
+    LLM_BATCH_COMPLETION_TOKENS: int = 2000
+    LLM_COMPLETION_TOKENS_PER_EMAIL: int = 150
+    LLM_EMAIL_TOKEN_BUDGET: int = 1500  # Emails above this are compacted to their most relevant lines
+    LLM_COMPACT_WINDOW_LINES: int = 2  # Context lines kept around each relevant line
+    LLM_BOILERPLATE_MIN_CHARS: int = 40
+    LLM_PLANNER_WINDOW: int = 40  # Messages collected before a packing pass
+    RULE_EXTRACTOR_MIN_CONFIDENCE: float = 0.8  # Below this the email goes to the LLM
+    BILL_CLASSIFIER_ENABLED: bool = True
+    BILL_CLASSIFIER_THRESHOLD: float = 0.3  # Messages scored below this are skipped before download
+    BILL_CLASSIFIER_WEIGHTS_PATH: str = ""  # Optional JSON {feature: weight} overrides
+    TEMPLATE_MIN_SAMPLES: int = 2  # Matching extractions before a sender template is used
+    TEMPLATE_MAX_FAILURES: int = 3
+    LLM_CACHE_BACKEND: str = "redis"  # "memory", "disk", "redis" or "none"
+    LLM_CACHE_MAX_BYTES: int = 16 * 1024 * 1024
+    LLM_CACHE_TTL: int = 30 * 24 * 3600
+    EXTRACTION_POOL_ENABLED: bool = True
+    EXTRACTION_TIMEOUT: float = 60.0  # Seconds per PDF/OCR job
+    EXTRACTION_MEMORY_LIMIT_MB: int = 1024  # Address-space cap per extraction process
+    PDF_BACKEND: str = "pdftotext"  # "pdftotext" (poppler) or "pypdf2"
+    PDF_MAX_PAGES: int = 5
+    PDF_MAX_CHARS: int = 20000
+    PDF_OCR_SCANNED_PAGES: bool = True
+    OCR_MIN_SIDE: int = 64  # Pixels; smaller images are icons or tracking pixels
+    OCR_MIN_AREA: int = 40000  # Pixels; signature logos and badges fall below this
+    OCR_SCRIPT_MIN_CONFIDENCE: float = 2.0  # Tesseract OSD script confidence needed to load a single model
+    OCR_TILE_HEIGHT: int = 2000
+    OCR_TILE_WORKERS: int = 2
+    BACKFILL_CHUNK_SIZE: int = 1000  # Bills normalized per transaction
+    BACKFILL_CHUNKS_PER_TASK: int = 20  # Then the task re-queues itself
+    ASYNC_DATABASE_URL: str = ""  # Defaults to DATABASE_URL with the asyncpg driver
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 20
+    DB_POOL_TIMEOUT: float = 30.0  # Seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 1800
+    USER_CACHE_SIZE: int = 1024
+    USER_CACHE_TTL: float = 60.0  # Seconds a user record is served without the database
+    BILLS_PAGE_SIZE: int = 100
+    BILLS_MAX_PAGE_SIZE: int = 500
+    SYNC_MODE: str = "pipeline"  # "pipeline" (asyncio, one task) or "fanout" (per-message Celery subtasks)
+    SYNC_FANOUT_CHUNK_SIZE: int = 20
+    SYNC_MESSAGE_MAX_ATTEMPTS: int = 3  # Syncs that may fail on a message before it is given up on
+    SYNC_QUEUE_SIZE: int = 100
+    SYNC_FETCH_CONCURRENCY: int = 4
+    SYNC_EXTRACT_CONCURRENCY: int = 4
+    SYNC_LLM_CONCURRENCY: int = 2
+    HTTP_CONNECT_TIMEOUT: float = 5.0
+    HTTP_READ_TIMEOUT: float = 30.0
+    HTTP_MAX_RETRIES: int = 3
+    HTTP_RETRY_AFTER_MAX: float = 30.0  # Longest Retry-After wait honoured before a retry
+    HTTP_LINK_TIMEOUT: float = 10.0  # Read timeout for links found in email bodies
+    HTTP_BACKOFF_FACTOR: float = 0.5
+    HTTP_POOL_CONNECTIONS: int = 10  # Number of hosts to keep pools for
+    HTTP_POOL_MAXSIZE: int = 20  # Connections kept alive per host
+    HTTP_SLOW_REQUEST_SECONDS: float = 5.0
 
     class Config:
         case_sensitive = True
@@ -1,10 +1,114 @@
-from sqlalchemy import create_engine
+from typing import AsyncIterator
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from app.config import settings
 from app.models import Base
 
-engine = create_engine(settings.DATABASE_URL, pool_pre_ping=True)
+POOL_OPTIONS = {
+    "pool_pre_ping": True,
+    "pool_size": settings.DB_POOL_SIZE,
+    "max_overflow": settings.DB_MAX_OVERFLOW,
+    "pool_timeout": settings.DB_POOL_TIMEOUT,
+    "pool_recycle": settings.DB_POOL_RECYCLE,
+}
+
+# Celery tasks, the sync pipeline and startup DDL use the sync engine
+engine = create_engine(settings.DATABASE_URL, **POOL_OPTIONS)
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 
+def _async_database_url() -> str:
+    if settings.ASYNC_DATABASE_URL:
+        return settings.ASYNC_DATABASE_URL
+    return make_url(settings.DATABASE_URL).set(drivername="postgresql+asyncpg").render_as_string(hide_password=False)
+
+# API endpoints use the async engine so queries don't hold a threadpool slot
+async_engine = create_async_engine(_async_database_url(), **POOL_OPTIONS)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """Request-scoped session dependency; rolled back on error and always closed."""
+    async with AsyncSessionLocal() as session:
+        try:
+            yield session
+        except Exception:
+            await session.rollback()
+            raise
+
+# Idempotent DDL for columns added after a database was first created with
+# create_all (which never alters existing tables). Use migrations in production.
+SCHEMA_UPGRADES = [
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS gmail_history_id VARCHAR",
+    # One-time migration: duplicates left by overlapping syncs must go before
+    # the unique index save_bills upserts against can exist
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('uq_bills_user_message') IS NULL THEN
+            DELETE FROM bills a USING bills b
+            WHERE a.user_id = b.user_id AND a.message_id = b.message_id AND a.id > b.id;
+            CREATE UNIQUE INDEX uq_bills_user_message ON bills (user_id, message_id);
+        END IF;
+    END $$
+    """,
+    "ALTER TABLE bills ADD COLUMN IF NOT EXISTS issued_on DATE",
+    "CREATE INDEX IF NOT EXISTS ix_bills_user_issued_on ON bills (user_id, issued_on, id)",
+    "ALTER TABLE bills ADD COLUMN IF NOT EXISTS due_on DATE",
+    "ALTER TABLE bills ADD COLUMN IF NOT EXISTS currency_code VARCHAR(3)",
+    "CREATE INDEX IF NOT EXISTS ix_bills_user_due_on ON bills (user_id, due_on, id)",
+    "CREATE INDEX IF NOT EXISTS ix_bills_user_amount ON bills (user_id, amount, id)",
+    "CREATE INDEX IF NOT EXISTS ix_bills_user_category ON bills (user_id, category)",
+    "CREATE INDEX IF NOT EXISTS ix_bills_user_vendor ON bills (user_id, vendor)",
+    "CREATE INDEX IF NOT EXISTS ix_bills_user_paid ON bills (user_id, paid)",
+    # Seed bill_summaries once from existing bills; afterwards save_bills keeps it current
+    """
+    INSERT INTO bill_summaries (user_id, month, category, currency, paid, total, count)
+    SELECT user_id, COALESCE(to_char(issued_on, 'YYYY-MM'), ''), COALESCE(category, ''), COALESCE(currency_code, ''),
+           paid, COALESCE(SUM(amount), 0), COUNT(*)
+    FROM bills
+    WHERE user_id IS NOT NULL AND NOT EXISTS (SELECT 1 FROM bill_summaries)
+    GROUP BY 1, 2, 3, 4, 5
+    """,
+    # Templates were shared across users; ones learned before they were scoped can't be attributed
+    "ALTER TABLE extraction_templates ADD COLUMN IF NOT EXISTS user_id INTEGER REFERENCES users(id)",
+    "DELETE FROM extraction_templates WHERE user_id IS NULL",
+    "ALTER TABLE extraction_templates ALTER COLUMN user_id SET NOT NULL",
+    "ALTER TABLE extraction_templates DROP CONSTRAINT IF EXISTS uq_extraction_templates_sender_fingerprint",
+    "DROP INDEX IF EXISTS ix_extraction_templates_sender",
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('uq_extraction_templates_user_sender_fingerprint') IS NULL THEN
+            ALTER TABLE extraction_templates ADD CONSTRAINT uq_extraction_templates_user_sender_fingerprint
+                UNIQUE (user_id, sender, fingerprint);
+        END IF;
+    END $$
+    """,
+]
+
+def upgrade_schema():
+    with engine.begin() as conn:
+        # Every API worker runs this at startup; let one at a time through
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('upgrade_schema'), 0)"))
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
+
+def _pool_stats(pool) -> dict:
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+    }
+
+def pool_status() -> dict:
+    """Connection pool usage of both engines, for the metrics endpoint."""
+    return {"sync": _pool_stats(engine.pool), "async": _pool_stats(async_engine.pool)}
+
 def close_engine():
     engine.dispose()
+
+async def close_async_engine():
+    await async_engine.dispose()
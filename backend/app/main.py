@@ -2,7 +2,8 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app import auth, tasks
 from app.config import settings
-from app.database import engine, Base
+from app.services import bill_backfill
+from app.database import engine, Base, upgrade_schema, pool_status, close_engine, close_async_engine
 from loguru import logger
 
 app = FastAPI(title="Gmail Bill Scanner API")
@@ -14,6 +15,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include routes for auth and API endpoints (sync, bills)
@@ -25,3 +27,16 @@ def startup_event():
     logger.info("Starting application...")
     # Auto-create database tables (use migrations in production)
     Base.metadata.create_all(bind=engine)
+    upgrade_schema()
+    # Fill the typed date/currency columns of bills saved before they existed
+    bill_backfill.start_once(tasks.backfill_bill_columns.delay)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await close_async_engine()
+    close_engine()
+
+@app.get("/metrics/db-pool")
+def db_pool_metrics():
+    """Connection pool usage of the sync and async engines in this process."""
+    return pool_status()
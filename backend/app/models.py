@@ -1,5 +1,5 @@
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Date, Numeric, Text, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Date, Numeric, Text, ForeignKey, Boolean, UniqueConstraint, Index
 from sqlalchemy.orm import relationship
 
 Base = declarative_base()
@@ -10,21 +10,62 @@ class User(Base):
     email = Column(String, unique=True, index=True, nullable=False)
     name = Column(String, nullable=True)
     google_refresh_token = Column(Text, nullable=False)
+    gmail_history_id = Column(String, nullable=True)  # Checkpoint for incremental Gmail sync
     bills = relationship("Bill", back_populates="user")
 
 class Bill(Base):
     __tablename__ = "bills"
+    __table_args__ = (
+        UniqueConstraint("user_id", "message_id", name="uq_bills_user_message"),
+        # Back the filters and keyset sorts of GET /api/bills
+        Index("ix_bills_user_issued_on", "user_id", "issued_on", "id"),
+        Index("ix_bills_user_due_on", "user_id", "due_on", "id"),
+        Index("ix_bills_user_amount", "user_id", "amount", "id"),
+        Index("ix_bills_user_category", "user_id", "category"),
+        Index("ix_bills_user_vendor", "user_id", "vendor"),
+        Index("ix_bills_user_paid", "user_id", "paid"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     message_id = Column(String, index=True)
     vendor = Column(String, nullable=True)
     date = Column(String, nullable=True)
     due_date = Column(String, nullable=True)
+    issued_on = Column(Date, nullable=True)  # date parsed for filtering and sorting
+    due_on = Column(Date, nullable=True)  # due_date parsed
     amount = Column(Numeric(12, 2), nullable=True)
     currency = Column(String(10), nullable=True)
+    currency_code = Column(String(3), nullable=True)  # ISO 4217
     category = Column(String, nullable=True)
     status = Column(String, nullable=True)
     blob_name = Column(String, nullable=True)
     paid = Column(Boolean, default=False, nullable=False)
     
     user = relationship("User", back_populates="bills")
+
+class ExtractionTemplate(Base):
+    """Field anchors learned from past extractions of one sender's bill layout."""
+    __tablename__ = "extraction_templates"
+    __table_args__ = (UniqueConstraint("user_id", "sender", "fingerprint", name="uq_extraction_templates_user_sender_fingerprint"),)
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    sender = Column(String, nullable=False)  # Lowercased From address
+    fingerprint = Column(String(32), nullable=False)
+    anchors = Column(Text, nullable=False)  # JSON: field -> {"label", "next_line"}
+    vendor = Column(String, nullable=True)
+    category = Column(String, nullable=True)
+    currency = Column(String(10), nullable=True)
+    samples = Column(Integer, default=1, nullable=False)  # Extractions that agreed on these anchors
+    hits = Column(Integer, default=0, nullable=False)
+    failures = Column(Integer, default=0, nullable=False)
+
+class BillSummary(Base):
+    """Per-user bill totals by month, category, currency and paid flag, maintained by save_bills."""
+    __tablename__ = "bill_summaries"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    month = Column(String(7), primary_key=True)  # "YYYY-MM", "" when the bill date is unknown
+    category = Column(String, primary_key=True)  # "" when unknown
+    currency = Column(String(10), primary_key=True)  # ISO code, "" when unknown
+    paid = Column(Boolean, primary_key=True)
+    total = Column(Numeric(14, 2), default=0, nullable=False)
+    count = Column(Integer, default=0, nullable=False)
@@ -0,0 +1,516 @@
+import asyncio
+import base64
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterable
+from loguru import logger
+from sqlalchemy.dialects.postgresql import insert
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.services import gmail_service, pdf_service, image_service, html_service, http_client
+from app.services import batch_planner, template_store, bill_classifier, prompt_compactor, bill_normalizer, bill_summary, sync_retry
+from app.services.batch_planner import count_tokens
+from app.services.extraction_executor import get_executor
+from app.services.openai_service import extract_bills_data_from_batch, batch_prompt_overhead, BATCH_ITEM_OVERHEAD_TOKENS
+
+# Enhanced query with more Hebrew bill-related terms
+BILL_SUBJECT_KEYWORDS = [
+    "bill", "invoice", "receipt", "payment", "חשבונית", "קבלה", "חשבון", "ארנונה",
+    "מים", "גז", "חשמל", "לתשלום", "תשלום", "תשלומים", "חיוב", "tax",
+]
+SYNC_QUERY = f"has:attachment OR subject:({' OR '.join(BILL_SUBJECT_KEYWORDS)})"
+
+# Marks the end of a stage's input queue
+_DONE = object()
+
+def matches_sync_query(message: dict) -> bool:
+    """Local equivalent of SYNC_QUERY for messages found through the History API."""
+    if gmail_service.get_attachments_info(message):
+        return True
+    subject = (gmail_service.get_header(message, "Subject") or "").lower()
+    return any(keyword in subject for keyword in BILL_SUBJECT_KEYWORDS)
+
+def filter_new_message_ids(message_ids: List[str], user_id: int, db) -> List[str]:
+    """Drop IDs of messages that already produced a bill or were skipped by triage, one listing page at a time."""
+    existing_message_ids = {
+        result[0] for result in
+        db.query(models.Bill.message_id).filter(
+            models.Bill.user_id==user_id,
+            models.Bill.message_id.in_(message_ids)
+        ).all()
+    }
+    skipped_message_ids = sync_retry.skipped(user_id, [msg_id for msg_id in message_ids if msg_id not in existing_message_ids])
+    return [msg_id for msg_id in message_ids if msg_id not in existing_message_ids and msg_id not in skipped_message_ids]
+
+def needs_triage(incremental: bool) -> bool:
+    return incremental or settings.BILL_CLASSIFIER_ENABLED
+
+def triage_messages(messages: Dict[str, dict], incremental: bool, user_id: int, known_senders: Iterable[str] = ()) -> Dict[str, dict]:
+    """
+    Drop messages that are not worth a full fetch, judging by headers, snippet
+    and part list only. Messages the classifier drops are recorded as skipped.
+    """
+    if incremental:
+        messages = {msg_id: message for msg_id, message in messages.items() if matches_sync_query(message)}
+    if settings.BILL_CLASSIFIER_ENABLED and messages:
+        skipped = {}
+        messages = bill_classifier.filter_probable_bills(messages, known_senders, skipped)
+        sync_retry.remember_skipped(user_id, skipped)
+    return messages
+
+def is_extractable_attachment(attach: dict) -> bool:
+    filename = (attach.get("filename") or "").lower()
+    return filename.endswith(".pdf") or attach.get("mimeType") in ["application/pdf", "image/jpeg", "image/png"]
+
+def collect_message_text(msg_id: str, message: dict, attachment_data: dict) -> str:
+    """
+    Combine the body, attachment text and linked documents of a message,
+    compacted to the lines relevant to a bill when it exceeds the per-email budget.
+    attachment_data holds bytes downloaded ahead of time, keyed by (message_id, attachment_id).
+    """
+    full_text_segments = []
+
+    # Extract message body
+    payload = message.get("payload", {})
+    if payload.get("body", {}).get("data"):
+        body_text = base64.urlsafe_b64decode(payload["body"]["data"] + "==").decode("utf-8", errors="ignore")
+        full_text_segments.append(body_text)
+        urls = gmail_service.extract_urls_from_text(body_text)
+    else:
+        urls = []
+
+    # Process attachments
+    attachments = gmail_service.get_attachments_info(message)
+    for attach in attachments:
+        filename = attach["filename"]
+        mime = attach["mimeType"]
+        data = attachment_data.get((msg_id, attach["attachmentId"]))
+        if data is None:
+            if is_extractable_attachment(attach):
+                logger.error(f"Attachment download failed for {filename}")
+            continue
+
+        if filename.lower().endswith(".pdf") or mime == "application/pdf":
+            pdf_text = pdf_service.extract_text_from_pdf(data)
+            if pdf_text:
+                full_text_segments.append(pdf_text)
+        elif mime in ["image/jpeg", "image/png"]:
+            ocr_text = image_service.extract_text_from_image(data)
+            if ocr_text:
+                full_text_segments.append(ocr_text)
+
+    # Process URLs in the email
+    for url in urls:
+        try:
+            resp = http_client.get_link(url)
+            content_type = resp.headers.get("Content-Type", "")
+            if "application/pdf" in content_type or url.lower().endswith(".pdf"):
+                pdf_text = pdf_service.extract_text_from_pdf(resp.content)
+                if pdf_text:
+                    full_text_segments.append(pdf_text)
+            elif "text/html" in content_type:
+                html_text = html_service.extract_text_from_html(resp.text)
+                if html_text:
+                    full_text_segments.append(html_text)
+        except Exception as e:
+            logger.error(f"Failed to fetch URL {url}: {str(e)}")
+            continue
+
+    return prompt_compactor.compact("\n".join(full_text_segments))
+
+def detect_paid_status(bill_text: str) -> bool:
+    paid_keywords = ["receipt", "payment confirmation", "קבלה", "אישור תשלום"]
+    return any(keyword.lower() in bill_text.lower() for keyword in paid_keywords)
+
+def message_metadata(msg_id: str, combined_text: str, sender: str = None) -> Dict[str, Any]:
+    return {"message_id": msg_id, "paid": detect_paid_status(combined_text), "sender": sender}
+
+# Columns refreshed when a message is extracted again
+UPSERT_FIELDS = ["vendor", "date", "due_date", "issued_on", "due_on", "amount", "currency", "currency_code", "category", "status", "paid"]
+
+def _bill_row(bill_data: Dict[str, Any], metadata: Dict[str, Any], user_id: int) -> Dict[str, Any]:
+    return {
+        "user_id": user_id,
+        "message_id": metadata["message_id"],
+        "vendor": bill_data.get("vendor"),
+        "date": bill_data.get("date"),
+        "due_date": bill_data.get("due_date"),
+        "issued_on": bill_normalizer.parse_date(bill_data.get("issued_on") or bill_data.get("date")),
+        "due_on": bill_normalizer.parse_date(bill_data.get("due_on") or bill_data.get("due_date")),
+        "amount": bill_data.get("amount"),
+        "currency": bill_data.get("currency"),
+        "currency_code": bill_data.get("currency_code") or bill_normalizer.normalize_currency(bill_data.get("currency")),
+        "category": bill_data.get("category"),
+        "status": bill_data.get("status"),
+        "blob_name": "",
+        "paid": metadata["paid"],
+    }
+
+def _upsert_bills(rows: List[Dict[str, Any]]):
+    statement = insert(models.Bill).values(rows)
+    return statement.on_conflict_do_update(
+        index_elements=[models.Bill.user_id, models.Bill.message_id],
+        set_={field: statement.excluded[field] for field in UPSERT_FIELDS},
+    )
+
+def _write_bills(db, user_id: int, rows: List[Dict[str, Any]]):
+    """Upsert rows and move the bill summary by the difference, in the caller's transaction."""
+    bill_summary.lock_user(db, user_id)
+    previous = db.query(
+        models.Bill.issued_on, models.Bill.category, models.Bill.currency_code, models.Bill.paid, models.Bill.amount
+    ).filter(
+        models.Bill.user_id == user_id,
+        models.Bill.message_id.in_([row["message_id"] for row in rows]),
+    ).all()
+    db.execute(_upsert_bills(rows))
+    deltas = bill_summary.SummaryDeltas()
+    for bill in bill_summary.bill_values(previous):
+        deltas.add(bill, -1)
+    for row in rows:
+        deltas.add(row)
+    bill_summary.apply_deltas(db, user_id, deltas)
+
+def save_bills(bill_data_batch: List[Dict[str, Any]], batch_metadata: List[Dict[str, Any]], user_id: int, db,
+               failed: set = None) -> int:
+    """
+    Upsert a batch of bills in one statement, keyed on (user_id, message_id) so
+    overlapping syncs update rather than duplicate, and update the bill summary
+    in the same transaction. If the batch is rejected, rows are retried one by
+    one (each in a savepoint) and the message IDs that still fail are added to
+    failed, when given.
+    """
+    # One row per message: Postgres rejects an upsert that touches a row twice
+    rows = list({
+        metadata["message_id"]: _bill_row(bill_data, metadata, user_id)
+        for bill_data, metadata in zip(bill_data_batch, batch_metadata)
+    }.values())
+    if not rows:
+        return 0
+    try:
+        _write_bills(db, user_id, rows)
+        db.commit()
+        return len(rows)
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"Bulk save of {len(rows)} bills failed, retrying row by row: {str(e)}")
+
+    saved = 0
+    for row in rows:
+        try:
+            with db.begin_nested():
+                _write_bills(db, user_id, [row])
+            saved += 1
+        except Exception as e:
+            logger.error(f"Error saving bill for message {row['message_id']}: {str(e)}")
+            if failed is not None:
+                failed.add(row["message_id"])
+    db.commit()
+    return saved
+
+class BatchPacker:
+    """
+    Collects extracted message texts and bin-packs them into as few LLM
+    requests as the prompt and completion budgets allow. Emails too large for
+    one request are split into parts that are planned like any other item;
+    ResultAssembler puts their results back together.
+    """
+
+    def __init__(self, window: int = None):
+        self.window = window or settings.LLM_PLANNER_WINDOW
+        self.prompt_budget = settings.LLM_BATCH_PROMPT_TOKENS - batch_prompt_overhead()
+        self.max_items = max(1, settings.LLM_BATCH_COMPLETION_TOKENS // settings.LLM_COMPLETION_TOKENS_PER_EMAIL)
+        self.pending = []  # (text, tokens, metadata)
+
+    def add(self, msg_id: str, combined_text: str, sender: str = None) -> list:
+        """Queue a message; returns the (batch_texts, batch_metadata) batches that are ready to send."""
+        metadata = message_metadata(msg_id, combined_text, sender)
+        max_item_tokens = self.prompt_budget - BATCH_ITEM_OVERHEAD_TOKENS
+        parts = batch_planner.split_text(combined_text, max_item_tokens)
+        if len(parts) > 1:
+            logger.info(f"Splitting message {msg_id} into {len(parts)} parts to fit the prompt budget")
+        for index, part in enumerate(parts):
+            tokens = count_tokens(part) + BATCH_ITEM_OVERHEAD_TOKENS
+            self.pending.append((part, tokens, dict(metadata, part=index, parts=len(parts))))
+        if len(self.pending) >= self.window:
+            return self._plan(final=False)
+        return []
+
+    def flush(self) -> list:
+        return self._plan(final=True)
+
+    def _plan(self, final: bool) -> list:
+        plan = batch_planner.plan_batches([tokens for _, tokens, _ in self.pending], self.prompt_budget, self.max_items)
+        if not final and len(plan) > 1:
+            # Hold back the least full batch so later messages can fill it
+            held = [self.pending[i] for i in plan.pop()]
+        else:
+            held = []
+        batches = [
+            ([self.pending[i][0] for i in indices], [self.pending[i][2] for i in indices])
+            for indices in plan
+        ]
+        self.pending = held
+        return batches
+
+class ResultAssembler:
+    """Merges the extraction results of split emails once all of their parts are back."""
+
+    def __init__(self):
+        self.partial = {}  # message_id -> {part: bill_data}
+
+    def add(self, bill_data_batch: List[Dict[str, Any]], batch_metadata: List[Dict[str, Any]]):
+        """Returns the (bill_data_batch, batch_metadata) of the messages that are now complete."""
+        complete_data = []
+        complete_metadata = []
+        for bill_data, metadata in zip(bill_data_batch, batch_metadata):
+            if metadata.get("parts", 1) == 1:
+                complete_data.append(bill_data)
+                complete_metadata.append(metadata)
+                continue
+            parts = self.partial.setdefault(metadata["message_id"], {})
+            parts[metadata["part"]] = bill_data
+            if len(parts) == metadata["parts"]:
+                del self.partial[metadata["message_id"]]
+                complete_data.append(batch_planner.merge_bill_results([parts[i] for i in sorted(parts)]))
+                complete_metadata.append(metadata)
+        return complete_data, complete_metadata
+
+def fetch_message_text(access_token: str, msg_id: str, user_id: int, incremental: bool = False, triage: bool = True):
+    """
+    Fetch and extract a single message on its own (used by per-message fan-out
+    tasks). Returns (text, From header). Retried messages pass triage=False.
+    """
+    if triage and needs_triage(incremental):
+        summary = gmail_service.get_message(access_token, msg_id, fields=gmail_service.TRIAGE_FIELDS)
+        if not triage_messages({msg_id: summary}, incremental, user_id, template_store.known_senders(user_id)):
+            return "", gmail_service.get_header(summary, "From")
+    message = gmail_service.get_message(access_token, msg_id)
+    sender = gmail_service.get_header(message, "From")
+    attachment_refs = [
+        (msg_id, attach["attachmentId"])
+        for attach in gmail_service.get_attachments_info(message)
+        if is_extractable_attachment(attach)
+    ]
+    attachment_data = {}
+    if attachment_refs:
+        attachment_data = gmail_service.batch_download_attachments(
+            access_token, attachment_refs, batch_size=settings.GMAIL_ATTACHMENT_BATCH_SIZE
+        )
+    return collect_message_text(msg_id, message, attachment_data), sender
+
+def _item_message_ids(item) -> List[str]:
+    """Message IDs carried by an item of any SyncPipeline stage queue."""
+    if isinstance(item, list):
+        return item  # ID chunk
+    if isinstance(item, dict):
+        return list(item)  # {message_id: message}
+    if len(item) == 3:
+        return [item[0]]  # (message_id, message, attachment_data)
+    return [metadata["message_id"] for metadata in item[1]]  # (texts or bill data, metadata)
+
+class SyncPipeline:
+    """
+    Asyncio pipeline for one user's sync. Stages run concurrently and are
+    connected by bounded queues, so a slow stage applies backpressure to the
+    ones before it:
+
+        list -> fetch messages -> download attachments -> extract -> batch -> LLM -> persist
+
+    Messages whose sender has a learned extraction template skip the LLM and go
+    straight from the batch stage to persist. The user's templates are loaded
+    once when the sync starts and their hit counts saved when it ends.
+
+    IDs of messages that a stage failed on are collected in failed_ids so the
+    caller can retry them; retry_ids are queued ahead of the listing and are
+    not triaged again.
+
+    Blocking Gmail, OpenAI and database calls run in threads; text extraction
+    runs on a dedicated thread executor whose PDF/OCR work is handed to the
+    extraction process pool.
+    """
+
+    def __init__(self, access_token: str, user_id: int, db, pages, incremental: bool = False, retry_ids: List[str] = ()):
+        self.access_token = access_token
+        self.user_id = user_id
+        self.db = db
+        self.pages = pages
+        self.incremental = incremental
+        self.retry_ids = list(retry_ids)
+        self.retry_set = set(self.retry_ids)
+        self.queue_size = settings.SYNC_QUEUE_SIZE
+        self.listed_count = 0
+        self.new_count = 0
+        self.saved_count = 0
+        self.listing_error = None
+        self.failed_ids = set()
+        self.assembler = ResultAssembler()
+
+    async def run(self) -> "SyncPipeline":
+        ids_q = asyncio.Queue(self.queue_size)
+        messages_q = asyncio.Queue(self.queue_size)
+        downloaded_q = asyncio.Queue(self.queue_size)
+        texts_q = asyncio.Queue(self.queue_size)
+        batches_q = asyncio.Queue(settings.SYNC_LLM_CONCURRENCY * 2)
+        results_q = asyncio.Queue(settings.SYNC_LLM_CONCURRENCY * 2)
+
+        # Enough extraction threads to keep every process of the extraction pool busy
+        extract_concurrency = max(settings.SYNC_EXTRACT_CONCURRENCY, get_executor().max_workers)
+        self.templates = await asyncio.to_thread(template_store.load_templates, self.user_id)
+        try:
+            with ThreadPoolExecutor(max_workers=extract_concurrency, thread_name_prefix="extract") as executor:
+                self.executor = executor
+                await asyncio.gather(
+                    self._list(ids_q),
+                    self._stage(ids_q, messages_q, self._fetch_messages, settings.SYNC_FETCH_CONCURRENCY),
+                    self._stage(messages_q, downloaded_q, self._download_attachments, settings.SYNC_FETCH_CONCURRENCY),
+                    self._stage(downloaded_q, texts_q, self._extract_text, extract_concurrency),
+                    self._batch(texts_q, batches_q, results_q),
+                    self._stage(batches_q, results_q, self._extract_bills, settings.SYNC_LLM_CONCURRENCY),
+                    self._stage(results_q, None, self._persist, 1),
+                )
+        finally:
+            await asyncio.to_thread(self.templates.flush)
+        return self
+
+    async def _stage(self, inbox: asyncio.Queue, outbox, handler, concurrency: int):
+        """Run `concurrency` workers feeding each item of inbox through handler into outbox."""
+        async def worker():
+            while True:
+                item = await inbox.get()
+                if item is _DONE:
+                    # Hand the marker on so sibling workers stop too
+                    await inbox.put(_DONE)
+                    return
+                try:
+                    for result in await handler(item):
+                        if outbox is not None:
+                            await outbox.put(result)
+                except Exception as e:
+                    logger.error(f"Sync pipeline stage {handler.__name__} failed: {str(e)}")
+                    logger.error(traceback.format_exc())
+                    self.failed_ids.update(_item_message_ids(item))
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        if outbox is not None:
+            await outbox.put(_DONE)
+
+    async def _list(self, ids_q: asyncio.Queue):
+        db = SessionLocal()
+        try:
+            for i in range(0, len(self.retry_ids), settings.GMAIL_BATCH_SIZE):
+                await ids_q.put(self.retry_ids[i:i + settings.GMAIL_BATCH_SIZE])
+            while True:
+                message_ids = await asyncio.to_thread(next, self.pages, None)
+                if message_ids is None:
+                    break
+                self.listed_count += len(message_ids)
+                message_ids = [msg_id for msg_id in message_ids if msg_id not in self.retry_set]
+                if self.incremental:
+                    # History only reports mail added after the checkpoint, so nothing is stored yet
+                    new_message_ids = message_ids
+                else:
+                    new_message_ids = await asyncio.to_thread(filter_new_message_ids, message_ids, self.user_id, db)
+                self.new_count += len(new_message_ids)
+                logger.info(f"Queueing {len(new_message_ids)} new of {len(message_ids)} listed messages")
+                for i in range(0, len(new_message_ids), settings.GMAIL_BATCH_SIZE):
+                    await ids_q.put(new_message_ids[i:i + settings.GMAIL_BATCH_SIZE])
+        except Exception as e:
+            # Listing stopped part way: finish what was queued but let the caller know
+            self.listing_error = e
+            logger.error(f"Gmail listing failed: {str(e)}")
+            logger.error(traceback.format_exc())
+        finally:
+            db.close()
+            await ids_q.put(_DONE)
+
+    async def _fetch_messages(self, message_ids: List[str]):
+        triage_ids = [msg_id for msg_id in message_ids if msg_id not in self.retry_set]
+        if triage_ids and needs_triage(self.incremental):
+            # Headers and part list first; full bodies only for messages that pass triage
+            summaries = await asyncio.to_thread(
+                gmail_service.batch_get_messages, self.access_token, triage_ids,
+                batch_size=settings.GMAIL_BATCH_SIZE, fields=gmail_service.TRIAGE_FIELDS
+            )
+            self.failed_ids.update(msg_id for msg_id in triage_ids if msg_id not in summaries)
+            kept = await asyncio.to_thread(triage_messages, summaries, self.incremental, self.user_id, self.templates.senders)
+            skipped_bytes = sum(summary.get("sizeEstimate", 0) for msg_id, summary in summaries.items() if msg_id not in kept)
+            if skipped_bytes:
+                logger.info(f"Triage skipped {len(summaries) - len(kept)} messages (~{skipped_bytes // 1024} KB) before the full fetch")
+            message_ids = [msg_id for msg_id in message_ids if msg_id in kept or msg_id in self.retry_set]
+            if not message_ids:
+                return []
+        messages = await asyncio.to_thread(
+            gmail_service.batch_get_messages, self.access_token, message_ids, batch_size=settings.GMAIL_BATCH_SIZE
+        )
+        self.failed_ids.update(msg_id for msg_id in message_ids if msg_id not in messages)
+        return [messages] if messages else []
+
+    async def _download_attachments(self, messages: Dict[str, dict]):
+        attachment_refs = [
+            (msg_id, attach["attachmentId"])
+            for msg_id, message in messages.items()
+            for attach in gmail_service.get_attachments_info(message)
+            if is_extractable_attachment(attach)
+        ]
+        attachment_data = {}
+        if attachment_refs:
+            attachment_data = await asyncio.to_thread(
+                gmail_service.batch_download_attachments, self.access_token, attachment_refs,
+                batch_size=settings.GMAIL_ATTACHMENT_BATCH_SIZE
+            )
+        # Extract what did arrive, but retry the message for the attachments that didn't
+        self.failed_ids.update(ref[0] for ref in attachment_refs if ref not in attachment_data)
+        return [(msg_id, message, attachment_data) for msg_id, message in messages.items()]
+
+    async def _extract_text(self, item):
+        msg_id, message, attachment_data = item
+        loop = asyncio.get_running_loop()
+        try:
+            combined_text = await loop.run_in_executor(self.executor, collect_message_text, msg_id, message, attachment_data)
+        except Exception as e:
+            logger.error(f"Error processing message {msg_id}: {str(e)}")
+            logger.error(traceback.format_exc())
+            self.failed_ids.add(msg_id)
+            return []
+        if not combined_text:
+            return []
+        sender = gmail_service.get_header(message, "From")
+        template_bill = await asyncio.to_thread(self.templates.match, sender, combined_text)
+        return [(msg_id, combined_text, sender, template_bill)]
+
+    async def _batch(self, texts_q: asyncio.Queue, batches_q: asyncio.Queue, results_q: asyncio.Queue):
+        """Plan extracted texts into packed LLM batches as they arrive."""
+        packer = BatchPacker()
+        while True:
+            item = await texts_q.get()
+            if item is _DONE:
+                break
+            msg_id, combined_text, sender, template_bill = item
+            if template_bill:
+                # Queued ahead of the LLM stage's end marker, so persist always sees it
+                await results_q.put(([template_bill], [message_metadata(msg_id, combined_text, sender)]))
+                continue
+            for batch in packer.add(msg_id, combined_text, sender):
+                await batches_q.put(batch)
+        for batch in packer.flush():
+            await batches_q.put(batch)
+        await batches_q.put(_DONE)
+
+    async def _extract_bills(self, batch):
+        batch_texts, batch_metadata = batch
+        logger.info(f"Sending batch of {len(batch_texts)} emails to OpenAI for analysis")
+        bill_data_batch = await asyncio.to_thread(
+            extract_bills_data_from_batch, batch_texts, [metadata.get("sender") for metadata in batch_metadata]
+        )
+        await asyncio.to_thread(template_store.learn_batch, self.user_id, batch_texts, bill_data_batch, batch_metadata)
+        return [(bill_data_batch, batch_metadata)]
+
+    async def _persist(self, result):
+        bill_data_batch, batch_metadata = self.assembler.add(*result)
+        if not bill_data_batch:
+            return []
+        self.saved_count += await asyncio.to_thread(
+            save_bills, bill_data_batch, batch_metadata, self.user_id, self.db, self.failed_ids
+        )
+        return []
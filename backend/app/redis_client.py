@@ -0,0 +1,11 @@
+import redis
+from app.config import settings
+
+_client = None
+
+def get_redis() -> redis.Redis:
+    """Shared client for the Redis instance Celery already uses (connections are re-created after fork)."""
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
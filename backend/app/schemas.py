@@ -1,15 +1,20 @@
+import datetime
 from pydantic import BaseModel
 
 class BillBase(BaseModel):
     vendor: str | None = None
     date: str | None = None
     due_date: str | None = None
+    issued_on: datetime.date | None = None
+    due_on: datetime.date | None = None
     amount: float | None = None
     currency: str | None = None
+    currency_code: str | None = None
     category: str | None = None
     status: str | None = None
     blob_name: str | None = None
     message_id: str | None = None
+    paid: bool | None = None
 
 class BillOut(BillBase):
     id: int
@@ -17,3 +22,11 @@ class BillOut(BillBase):
 
     class Config:
         from_attributes = True  # Updated from orm_mode
+
+class BillSummaryOut(BaseModel):
+    month: str | None = None
+    category: str | None = None
+    currency: str | None = None
+    paid: bool
+    total: float
+    count: int
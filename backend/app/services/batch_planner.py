@@ -0,0 +1,109 @@
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any
+from loguru import logger
+from app.config import settings
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding(settings.TOKENIZER_ENCODING)
+except Exception as e:  # tiktoken missing or encoding files unavailable
+    logger.warning(f"tiktoken unavailable ({e}); using the approximate token counter")
+    _encoding = None
+
+# Latin words cost about one token per 4 letters, numbers about one per 3 digits;
+# Hebrew letters, other scripts and punctuation (OCR noise) about one each.
+_APPROX_TOKEN_RE = re.compile(r"[A-Za-z]+|\d+|\S")
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_CACHE_SIZE = 4096
+
+def _approximate_tokens(text: str) -> int:
+    total = 0
+    for piece in _APPROX_TOKEN_RE.findall(text):
+        if piece[0].isascii() and piece[0].isalpha():
+            total += -(-len(piece) // 4)
+        elif piece[0].isdigit():
+            total += -(-len(piece) // 3)
+        else:
+            total += 1
+    return total
+
+def count_tokens(text: str) -> int:
+    """Token count of text for the deployment's tokenizer, memoized by content hash."""
+    if not text:
+        return 0
+    key = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    if _encoding is not None:
+        count = len(_encoding.encode(text, disallowed_special=()))
+    else:
+        count = _approximate_tokens(text)
+    with _cache_lock:
+        _cache[key] = count
+        if len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return count
+
+def split_text(text: str, max_tokens: int) -> List[str]:
+    """Split text into chunks of at most max_tokens, on line boundaries where possible."""
+    if count_tokens(text) <= max_tokens:
+        return [text]
+    chunks = []
+    current = []
+    current_tokens = 0
+    for line in text.split("\n"):
+        line_tokens = count_tokens(line) + 1
+        if line_tokens > max_tokens:
+            # A single huge line (e.g. flattened PDF text): cut it by characters
+            step = max(1, len(line) * max_tokens // line_tokens)
+            pieces = [line[i:i + step] for i in range(0, len(line), step)]
+        else:
+            pieces = [line]
+        for piece in pieces:
+            piece_tokens = count_tokens(piece) + 1
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+def plan_batches(token_counts: List[int], prompt_budget: int, max_items: int) -> List[List[int]]:
+    """
+    Bin-pack items (given by their token counts) into as few batches as
+    possible with first-fit decreasing. Each batch stays within prompt_budget
+    tokens and max_items items. Returns lists of item indices, fullest first.
+    Items larger than the budget get a batch of their own; split them first.
+    """
+    order = sorted(range(len(token_counts)), key=lambda i: token_counts[i], reverse=True)
+    batches = []  # [tokens_used, [indices]]
+    for i in order:
+        for batch in batches:
+            if batch[0] + token_counts[i] <= prompt_budget and len(batch[1]) < max_items:
+                batch[0] += token_counts[i]
+                batch[1].append(i)
+                break
+        else:
+            batches.append([token_counts[i], [i]])
+    batches.sort(key=lambda batch: batch[0], reverse=True)
+    return [sorted(indices) for _, indices in batches]
+
+def merge_bill_results(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine extractions of the chunks of one split email: the first non-empty value of each field wins."""
+    merged = {}
+    for part in parts:
+        for field, value in (part or {}).items():
+            if merged.get(field) is None and value is not None:
+                merged[field] = value
+            else:
+                merged.setdefault(field, value)
+    return merged
@@ -0,0 +1,83 @@
+from typing import Optional, Tuple
+import redis
+from loguru import logger
+from app import models
+from app.redis_client import get_redis
+from app.services import bill_normalizer
+
+# Fills issued_on, due_on and currency_code for bills saved before those
+# columns existed. Walks the table in primary-key order, one short transaction
+# per chunk, and checkpoints the last id in Redis so an interrupted run resumes.
+
+CHECKPOINT_KEY = "backfill:bill_columns:last_id"
+DONE_KEY = "backfill:bill_columns:done"
+QUEUED_KEY = "backfill:bill_columns:queued"
+QUEUED_TTL = 3600
+
+def start_once(enqueue) -> bool:
+    """
+    Call enqueue() unless the backfill has already finished or another process
+    queued it within the last hour. Run at API startup, so a deploy that adds
+    the columns fills them without a manual step.
+    """
+    try:
+        r = get_redis()
+        if r.exists(DONE_KEY) or not r.set(QUEUED_KEY, 1, nx=True, ex=QUEUED_TTL):
+            return False
+    except redis.RedisError as e:
+        logger.warning(f"Could not check the bill column backfill state, not queueing it: {str(e)}")
+        return False
+    enqueue()
+    logger.info("Queued the bill column backfill")
+    return True
+
+def mark_done():
+    try:
+        get_redis().set(DONE_KEY, 1)
+    except redis.RedisError as e:
+        logger.warning(f"Could not record the finished backfill: {str(e)}")
+
+def load_checkpoint() -> int:
+    try:
+        return int(get_redis().get(CHECKPOINT_KEY) or 0)
+    except redis.RedisError as e:
+        logger.warning(f"Could not read backfill checkpoint, starting from the beginning: {str(e)}")
+        return 0
+
+def save_checkpoint(last_id: Optional[int]):
+    try:
+        if last_id is None:
+            get_redis().delete(CHECKPOINT_KEY)
+        else:
+            get_redis().set(CHECKPOINT_KEY, last_id)
+    except redis.RedisError as e:
+        logger.warning(f"Could not save backfill checkpoint: {str(e)}")
+
+def backfill_chunk(db, after_id: int, chunk_size: int) -> Tuple[Optional[int], int]:
+    """
+    Normalize the next chunk of bills with id > after_id. Returns (last id
+    scanned, rows updated); last id is None once the table is exhausted.
+    """
+    rows = db.query(
+        models.Bill.id, models.Bill.date, models.Bill.due_date, models.Bill.currency,
+        models.Bill.issued_on, models.Bill.due_on, models.Bill.currency_code,
+    ).filter(models.Bill.id > after_id).order_by(models.Bill.id).limit(chunk_size).all()
+    if not rows:
+        return None, 0
+
+    mappings = []
+    for row in rows:
+        values = {}
+        if row.issued_on is None and row.date:
+            values["issued_on"] = bill_normalizer.parse_date(row.date)
+        if row.due_on is None and row.due_date:
+            values["due_on"] = bill_normalizer.parse_date(row.due_date)
+        if row.currency_code is None and row.currency:
+            values["currency_code"] = bill_normalizer.normalize_currency(row.currency)
+        values = {column: value for column, value in values.items() if value is not None}
+        if values:
+            mappings.append(dict(values, id=row.id))
+    if mappings:
+        db.bulk_update_mappings(models.Bill, mappings)
+    db.commit()
+    return rows[-1].id, len(mappings)
@@ -0,0 +1,142 @@
+import json
+import math
+import os
+import re
+from typing import Dict, Iterable, List, Tuple
+from loguru import logger
+from app.config import settings
+from app.services import gmail_service
+from app.services.template_store import sender_address
+
+# Linear model over named features of a message's headers, snippet and MIME
+# structure, all available before any attachment is downloaded. The weights
+# are hand-tuned; a JSON file of {feature: weight} (BILL_CLASSIFIER_WEIGHTS_PATH)
+# overrides or extends them, e.g. with weights fitted on labelled mail.
+
+WEIGHTS = {
+    "bias": -1.0,
+    "sender:known_biller": 3.0,
+    "sender:billing_mailbox": 1.5,
+    "sender:gov": 1.0,
+    "subject:bill_keyword": 2.0,
+    "subject:promo_keyword": -1.5,
+    "snippet:bill_keyword": 1.0,
+    "snippet:amount": 1.0,
+    "attachment:pdf": 1.0,
+    "attachment:bill_name": 2.0,
+    # Mild: bills are often forwarded as phone photos, which must still reach OCR
+    "attachment:photo_name": -0.5,
+    "attachment:personal_document": -3.0,
+    "attachment:images_only": -0.25,
+    "attachment:none": -0.5,
+    "header:list_unsubscribe": -0.5,
+    "header:bulk": -0.5,
+    "label:promotions": -1.5,
+    "label:social": -2.0,
+    "label:forums": -1.5,
+    "label:updates": 0.3,
+}
+
+BILL_KEYWORDS = re.compile(
+    r"bill|invoice|receipt|statement|payment|amount due|חשבונית|קבלה|חשבון|ארנונה|חשמל|לתשלום|תשלום|חיוב",
+    re.IGNORECASE,
+)
+PROMO_KEYWORDS = re.compile(r"sale|discount|% off|newsletter|webinar|unsubscribe|מבצע|הנחה|ניוזלטר", re.IGNORECASE)
+BILLING_MAILBOX = re.compile(r"bill|invoice|receipt|payment|account|finance|חשבון", re.IGNORECASE)
+AMOUNT_RE = re.compile(r"(?:₪|\$|€|£|NIS|ש\"ח|ש״ח)\s*\d|\d\s*(?:₪|NIS|ש\"ח|ש״ח)", re.IGNORECASE)
+BILL_FILENAME = re.compile(r"bill|invoice|receipt|statement|inv[_\-\d]|חשבונית|קבלה|חשבון", re.IGNORECASE)
+PHOTO_FILENAME = re.compile(r"^(?:img|dsc|pxl|photo|screenshot|whatsapp image)[_\-\s]", re.IGNORECASE)
+PERSONAL_FILENAME = re.compile(r"\bcv\b|resume|résumé|קורות חיים|portfolio", re.IGNORECASE)
+LABEL_FEATURES = {
+    "CATEGORY_PROMOTIONS": "label:promotions",
+    "CATEGORY_SOCIAL": "label:social",
+    "CATEGORY_FORUMS": "label:forums",
+    "CATEGORY_UPDATES": "label:updates",
+}
+
+def _load_weights() -> Dict[str, float]:
+    weights = dict(WEIGHTS)
+    path = settings.BILL_CLASSIFIER_WEIGHTS_PATH
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                weights.update({feature: float(weight) for feature, weight in json.load(f).items()})
+            logger.info(f"Loaded bill classifier weights from {path}")
+        except (OSError, ValueError, AttributeError) as e:
+            logger.warning(f"Ignoring bill classifier weights in {path}: {str(e)}")
+    return weights
+
+_weights = _load_weights()
+
+def extract_features(message: dict, known_senders: Iterable[str] = ()) -> List[str]:
+    features = []
+    sender = sender_address(gmail_service.get_header(message, "From")) or ""
+    local_part, _, domain = sender.partition("@")
+    if sender and sender in known_senders:
+        features.append("sender:known_biller")
+    if BILLING_MAILBOX.search(local_part):
+        features.append("sender:billing_mailbox")
+    if domain.endswith(".gov.il") or ".muni." in f".{domain}":
+        features.append("sender:gov")
+
+    subject = gmail_service.get_header(message, "Subject") or ""
+    if BILL_KEYWORDS.search(subject):
+        features.append("subject:bill_keyword")
+    if PROMO_KEYWORDS.search(subject):
+        features.append("subject:promo_keyword")
+    snippet = message.get("snippet") or ""
+    if BILL_KEYWORDS.search(snippet):
+        features.append("snippet:bill_keyword")
+    if AMOUNT_RE.search(snippet):
+        features.append("snippet:amount")
+
+    attachments = gmail_service.get_attachments_info(message)
+    if not attachments:
+        features.append("attachment:none")
+    mime_types = [(attach.get("mimeType") or "").lower() for attach in attachments]
+    if any(mime == "application/pdf" or attach["filename"].lower().endswith(".pdf") for attach, mime in zip(attachments, mime_types)):
+        features.append("attachment:pdf")
+    if attachments and all(mime.startswith("image/") for mime in mime_types):
+        features.append("attachment:images_only")
+    filenames = [attach["filename"] for attach in attachments]
+    if any(BILL_FILENAME.search(name) for name in filenames):
+        features.append("attachment:bill_name")
+    if any(PHOTO_FILENAME.search(name) for name in filenames):
+        features.append("attachment:photo_name")
+    if any(PERSONAL_FILENAME.search(name) for name in filenames):
+        features.append("attachment:personal_document")
+
+    if gmail_service.get_header(message, "List-Unsubscribe"):
+        features.append("header:list_unsubscribe")
+    if (gmail_service.get_header(message, "Precedence") or "").lower() in ("bulk", "list"):
+        features.append("header:bulk")
+    for label in message.get("labelIds") or []:
+        if label in LABEL_FEATURES:
+            features.append(LABEL_FEATURES[label])
+    return features
+
+def score_message(message: dict, known_senders: Iterable[str] = ()) -> Tuple[float, List[str]]:
+    """Probability that the message is a bill, with the features that produced it."""
+    features = extract_features(message, known_senders)
+    z = _weights["bias"] + sum(_weights.get(feature, 0.0) for feature in features)
+    return 1 / (1 + math.exp(-z)), features
+
+def filter_probable_bills(messages: Dict[str, dict], known_senders: Iterable[str] = (),
+                          skipped: Dict[str, float] = None) -> Dict[str, dict]:
+    """
+    Keep the messages scored at or above BILL_CLASSIFIER_THRESHOLD, logging
+    every score. The scores of the others are added to skipped, when given.
+    """
+    kept = {}
+    for msg_id, message in messages.items():
+        score, features = score_message(message, known_senders)
+        if score >= settings.BILL_CLASSIFIER_THRESHOLD:
+            kept[msg_id] = message
+            logger.debug(f"Bill classifier kept {msg_id} (score {score:.2f}: {', '.join(features)})")
+        else:
+            logger.info(f"Bill classifier skipped {msg_id} (score {score:.2f}: {', '.join(features)})")
+            if skipped is not None:
+                skipped[msg_id] = score
+    if len(kept) < len(messages):
+        logger.info(f"Bill classifier kept {len(kept)} of {len(messages)} messages")
+    return kept
@@ -0,0 +1,97 @@
+import re
+from datetime import date
+from typing import Optional
+from app.services.rule_extractor import CURRENCIES
+
+# The LLM returns dates and currencies as written on the bill. These helpers
+# turn them into typed values for the issued_on/due_on/currency_code columns.
+# Israeli bills write numeric dates day first, so 03/04/2024 is the 3rd of April.
+
+MONTHS = {
+    "jan": 1, "january": 1, "feb": 2, "february": 2, "mar": 3, "march": 3, "apr": 4, "april": 4,
+    "may": 5, "jun": 6, "june": 6, "jul": 7, "july": 7, "aug": 8, "august": 8, "sep": 9, "sept": 9,
+    "september": 9, "oct": 10, "october": 10, "nov": 11, "november": 11, "dec": 12, "december": 12,
+    "ינואר": 1, "פברואר": 2, "מרץ": 3, "מרס": 3, "אפריל": 4, "מאי": 5, "יוני": 6, "יולי": 7,
+    "אוגוסט": 8, "ספטמבר": 9, "אוקטובר": 10, "נובמבר": 11, "דצמבר": 12,
+}
+
+CURRENCY_ALIASES = {
+    "שקל": "ILS", "שקלים": "ILS", "ש.ח": "ILS", "ש״ח": "ILS", "new israeli shekel": "ILS", "shekel": "ILS",
+    "shekels": "ILS", "us$": "USD", "dollar": "USD", "dollars": "USD", "דולר": "USD",
+    "euro": "EUR", "euros": "EUR", "יורו": "EUR", "pound": "GBP", "pounds": "GBP",
+}
+# ISO 4217 codes accepted as written; other three-letter words ("VAT", "TOT") are not currencies
+ISO_CURRENCY_CODES = frozenset("""
+    ILS USD EUR GBP JPY CHF CAD AUD NZD CNY HKD SGD INR KRW TWD THB PHP IDR MYR VND
+    SEK NOK DKK ISK PLN CZK HUF RON BGN HRK RSD UAH RUB TRY GEL AMD AZN KZT
+    AED SAR QAR KWD BHD OMR JOD EGP MAD TND LBP IQD IRR
+    ZAR NGN KES GHS ETB MXN BRL ARS CLP COP PEN UYU
+""".split())
+
+_ISO_RE = re.compile(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})")
+_NUMERIC_RE = re.compile(r"(\d{1,2})[-/.](\d{1,2})[-/.](\d{2,4})")
+_DAY_MONTH_NAME_RE = re.compile(r"(\d{1,2})(?:st|nd|rd|th)?\s+(?:ב|of\s+)?([^\W\d_]+)\.?,?\s+(\d{4})", re.IGNORECASE)
+_MONTH_NAME_DAY_RE = re.compile(r"([^\W\d_]+)\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})", re.IGNORECASE)
+_MONTH_YEAR_RE = re.compile(r"^\s*(\d{1,2})[-/.](\d{4})\s*$")
+
+def _make_date(year: int, month: int, day: int) -> Optional[date]:
+    if year < 100:
+        year += 2000
+    try:
+        return date(year, month, day)
+    except ValueError:
+        return None
+
+def parse_date(value) -> Optional[date]:
+    """Parse a bill date string into a date, or None when it is not recognisable."""
+    if value is None:
+        return None
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    if not text:
+        return None
+
+    match = _ISO_RE.search(text)
+    if match:
+        return _make_date(int(match.group(1)), int(match.group(2)), int(match.group(3)))
+    match = _NUMERIC_RE.search(text)
+    if match:
+        day, month, year = int(match.group(1)), int(match.group(2)), int(match.group(3))
+        if month > 12 and day <= 12:
+            # Unambiguously month first (US style)
+            day, month = month, day
+        return _make_date(year, month, day)
+    match = _DAY_MONTH_NAME_RE.search(text)
+    if match and match.group(2).lower() in MONTHS:
+        return _make_date(int(match.group(3)), MONTHS[match.group(2).lower()], int(match.group(1)))
+    match = _MONTH_NAME_DAY_RE.search(text)
+    if match and match.group(1).lower() in MONTHS:
+        return _make_date(int(match.group(3)), MONTHS[match.group(1).lower()], int(match.group(2)))
+    match = _MONTH_YEAR_RE.match(text)
+    if match:
+        # Billing period such as 03/2024
+        return _make_date(int(match.group(2)), int(match.group(1)), 1)
+    return None
+
+def normalize_currency(value) -> Optional[str]:
+    """ISO 4217 code for a currency symbol, code or name as written on a bill."""
+    if value is None:
+        return None
+    text = str(value).strip()
+    if not text:
+        return None
+    if text in CURRENCIES:
+        return CURRENCIES[text]
+    lowered = text.lower().rstrip(".")
+    if lowered in CURRENCY_ALIASES:
+        return CURRENCY_ALIASES[lowered]
+    if text.upper() in CURRENCIES:
+        return CURRENCIES[text.upper()]
+    if text.upper() in ISO_CURRENCY_CODES:
+        return text.upper()
+    # Symbol with extra text, e.g. "NIS (incl. VAT)"
+    for symbol in sorted(CURRENCIES, key=len, reverse=True):
+        if symbol in text or (symbol.isascii() and symbol.isalpha() and re.search(rf"\b{symbol}\b", text, re.IGNORECASE)):
+            return CURRENCIES[symbol]
+    return None
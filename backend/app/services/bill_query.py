@@ -0,0 +1,105 @@
+import base64
+import json
+from datetime import date
+from decimal import Decimal
+from typing import Optional
+from sqlalchemy import tuple_
+from app import models
+
+# Keyset pagination for bill listings: rows are ordered by (sort column, id)
+# with NULLs last in both directions, and the cursor carries the last row's
+# (value, id). Non-NULL rows are read with a row-value comparison that the
+# (user_id, column, id) index scans forwards or backwards; the NULL tail is
+# read separately by id once they run out, so no page needs an OFFSET or sort.
+
+SORT_COLUMNS = {
+    "date": models.Bill.issued_on,
+    "due_date": models.Bill.due_on,
+    "amount": models.Bill.amount,
+    "id": models.Bill.id,
+}
+
+class InvalidCursorError(ValueError):
+    pass
+
+def encode_cursor(sort: str, bill: models.Bill) -> str:
+    value = getattr(bill, SORT_COLUMNS[sort].key)
+    if isinstance(value, (date, Decimal)):
+        value = str(value)
+    payload = json.dumps([sort, value, bill.id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, sort: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, last_id = json.loads(base64.urlsafe_b64decode(padded))
+        if cursor_sort != sort:
+            raise InvalidCursorError("Cursor belongs to a different sort order")
+        if value is not None and sort in ("date", "due_date"):
+            value = date.fromisoformat(value)
+        elif value is not None and sort == "amount":
+            value = Decimal(value)
+        return value, int(last_id)
+    except InvalidCursorError:
+        raise
+    except Exception as e:
+        raise InvalidCursorError(f"Malformed cursor: {e}")
+
+def filter_bills(query, vendor: str = None, category: str = None, paid: bool = None,
+                 date_from: date = None, date_to: date = None, due_from: date = None, due_to: date = None,
+                 currency: str = None, amount_min: float = None, amount_max: float = None):
+    if vendor is not None:
+        query = query.filter(models.Bill.vendor == vendor)
+    if category is not None:
+        query = query.filter(models.Bill.category == category)
+    if paid is not None:
+        query = query.filter(models.Bill.paid == paid)
+    if date_from is not None:
+        query = query.filter(models.Bill.issued_on >= date_from)
+    if date_to is not None:
+        query = query.filter(models.Bill.issued_on <= date_to)
+    if due_from is not None:
+        query = query.filter(models.Bill.due_on >= due_from)
+    if due_to is not None:
+        query = query.filter(models.Bill.due_on <= due_to)
+    if currency is not None:
+        query = query.filter(models.Bill.currency_code == currency.upper())
+    if amount_min is not None:
+        query = query.filter(models.Bill.amount >= amount_min)
+    if amount_max is not None:
+        query = query.filter(models.Bill.amount <= amount_max)
+    return query
+
+async def _fetch(db, statement, limit: int) -> list:
+    result = await db.execute(statement.limit(limit))
+    return list(result.scalars().all())
+
+async def paginate(db, statement, sort: str, descending: bool, limit: int, cursor: Optional[str] = None):
+    """Run a select() of bills for one page. Returns (bills, next_cursor); next_cursor is None on the last page."""
+    value, last_id = decode_cursor(cursor, sort) if cursor else (None, None)
+    beyond = (lambda left, right: left < right) if descending else (lambda left, right: left > right)
+    id_order = models.Bill.id.desc() if descending else models.Bill.id.asc()
+
+    if sort == "id":
+        if cursor:
+            statement = statement.where(beyond(models.Bill.id, last_id))
+        bills = await _fetch(db, statement.order_by(id_order), limit + 1)
+    else:
+        column = SORT_COLUMNS[sort]
+        in_null_tail = cursor is not None and value is None
+        bills = []
+        if not in_null_tail:
+            page = statement.where(column.is_not(None))
+            if cursor:
+                page = page.where(beyond(tuple_(column, models.Bill.id), tuple_(value, last_id)))
+            # Plain ASC/DESC (no NULLS LAST) so the index order serves both directions
+            bills = await _fetch(db, page.order_by(column.desc() if descending else column.asc(), id_order), limit + 1)
+        if len(bills) <= limit:
+            tail = statement.where(column.is_(None))
+            if in_null_tail:
+                tail = tail.where(beyond(models.Bill.id, last_id))
+            bills += await _fetch(db, tail.order_by(id_order), limit + 1 - len(bills))
+
+    if len(bills) > limit:
+        return bills[:limit], encode_cursor(sort, bills[limit - 1])
+    return bills, None
@@ -0,0 +1,93 @@
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, Iterable
+from sqlalchemy import func, text
+from sqlalchemy.dialects.postgresql import insert
+from app import models
+
+# Per-user totals by (month, category, currency, paid), kept in step with the
+# bills table by applying the difference each save makes, so the dashboard
+# summary reads a few rows per user instead of aggregating every bill.
+
+def summary_key(bill: Dict[str, Any]) -> tuple:
+    issued_on = bill.get("issued_on")
+    return (
+        issued_on.strftime("%Y-%m") if issued_on else "",
+        bill.get("category") or "",
+        bill.get("currency_code") or "",
+        bool(bill.get("paid")),
+    )
+
+def lock_user(db, user_id: int):
+    """
+    Serialize summary writers for one user until the transaction ends. Row
+    locks can't cover bills that don't exist yet, so without this two syncs
+    inserting the same new message would both count it.
+    """
+    db.execute(text("SELECT pg_advisory_xact_lock(:user_id)"), {"user_id": user_id})
+
+class SummaryDeltas:
+    """Accumulates total and count changes per summary group."""
+
+    def __init__(self):
+        self.groups = defaultdict(lambda: [Decimal("0"), 0])
+
+    def add(self, bill: Dict[str, Any], sign: int = 1):
+        group = self.groups[summary_key(bill)]
+        if bill.get("amount") is not None:
+            group[0] += sign * Decimal(str(bill["amount"]))
+        group[1] += sign
+
+    def rows(self, user_id: int) -> list:
+        # Sorted so concurrent saves lock summary rows in the same order
+        return [
+            {"user_id": user_id, "month": month, "category": category, "currency": currency,
+             "paid": paid, "total": total, "count": count}
+            for (month, category, currency, paid), (total, count) in sorted(self.groups.items())
+            if total or count
+        ]
+
+def apply_deltas(db, user_id: int, deltas: SummaryDeltas):
+    """Add the deltas to the user's summary rows inside the caller's transaction."""
+    rows = deltas.rows(user_id)
+    if not rows:
+        return
+    statement = insert(models.BillSummary).values(rows)
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[
+            models.BillSummary.user_id, models.BillSummary.month, models.BillSummary.category,
+            models.BillSummary.currency, models.BillSummary.paid,
+        ],
+        set_={
+            "total": models.BillSummary.total + statement.excluded.total,
+            "count": models.BillSummary.count + statement.excluded.count,
+        },
+    ))
+
+def bill_values(bills: Iterable) -> list:
+    """Summary-relevant fields of Bill rows (or row tuples with the same attribute names)."""
+    return [
+        {"issued_on": b.issued_on, "category": b.category, "currency_code": b.currency_code, "paid": b.paid, "amount": b.amount}
+        for b in bills
+    ]
+
+def rebuild(db, user_id: int):
+    """Recompute a user's summary from the bills table, e.g. after bulk edits that bypass save_bills."""
+    lock_user(db, user_id)
+    db.query(models.BillSummary).filter(models.BillSummary.user_id == user_id).delete(synchronize_session=False)
+    group = [
+        func.coalesce(func.to_char(models.Bill.issued_on, "YYYY-MM"), ""),
+        func.coalesce(models.Bill.category, ""),
+        func.coalesce(models.Bill.currency_code, ""),
+        models.Bill.paid,
+    ]
+    groups = db.query(*group, func.coalesce(func.sum(models.Bill.amount), 0), func.count(models.Bill.id)).filter(
+        models.Bill.user_id == user_id
+    ).group_by(*group).all()
+    deltas = SummaryDeltas()
+    for month, category, currency, paid, total, count in groups:
+        deltas.groups[(month, category, currency, bool(paid))] = [Decimal(total), count]
+    apply_deltas(db, user_id, deltas)
+
+def user_ids_with_bills(db) -> list:
+    return [row[0] for row in db.query(func.distinct(models.Bill.user_id)).all()]
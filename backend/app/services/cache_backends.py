@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+import redis
+from loguru import logger
+from app.redis_client import get_redis
+
+class CacheBackend:
+    """Byte-oriented key/value store shared by the extraction and LLM caches."""
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        raise NotImplementedError
+
+class NullBackend(CacheBackend):
+    def get(self, key: str) -> Optional[bytes]:
+        return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        pass
+
+class MemoryLRUBackend(CacheBackend):
+    """In-process LRU bounded by the total size of the stored values."""
+
+    def __init__(self, max_bytes: int, default_ttl: Optional[int] = None):
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.current_bytes = 0
+        self._items = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at and expires_at < time.time():
+                self._remove(key)
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._remove(key)
+            ttl = ttl or self.default_ttl
+            self._items[key] = (value, time.time() + ttl if ttl else None)
+            self.current_bytes += len(value)
+            while self.current_bytes > self.max_bytes:
+                self._remove(next(iter(self._items)))
+
+    def _remove(self, key: str):
+        value, _ = self._items.pop(key)
+        self.current_bytes -= len(value)
+
+class DiskBackend(CacheBackend):
+    """One file per key under a directory; the least recently used files are evicted past max_bytes."""
+
+    def __init__(self, directory: str, max_bytes: int, default_ttl: Optional[int] = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.current_bytes = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.is_file())
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                expires_at = float(f.readline() or 0)
+                value = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+        if expires_at and expires_at < time.time():
+            self._delete(path)
+            return None
+        os.utime(path)  # Mark as recently used for eviction
+        return value
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        if len(value) > self.max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        ttl = ttl or self.default_ttl
+        with open(tmp_path, "wb") as f:
+            f.write(f"{time.time() + ttl if ttl else 0}\n".encode("ascii"))
+            f.write(value)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.current_bytes += os.path.getsize(path)
+            if self.current_bytes > self.max_bytes:
+                self._evict()
+
+    def _delete(self, path: str):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            with self._lock:
+                self.current_bytes -= size
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        # Recount from disk since other processes share the directory
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.is_file()),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        self.current_bytes = sum(entry.stat().st_size for entry in entries)
+        target = self.max_bytes * 0.9
+        for entry in entries:
+            if self.current_bytes <= target:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                self.current_bytes -= size
+            except FileNotFoundError:
+                continue
+
+class RedisBackend(CacheBackend):
+    """Redis-backed cache shared across workers; size eviction is left to Redis' maxmemory policy."""
+
+    def __init__(self, namespace: str, max_item_bytes: int, default_ttl: Optional[int] = None):
+        self.namespace = namespace
+        self.max_item_bytes = max_item_bytes
+        self.default_ttl = default_ttl
+
+    def get(self, key: str) -> Optional[bytes]:
+        try:
+            return get_redis().get(f"{self.namespace}:{key}")
+        except redis.RedisError as e:
+            logger.warning(f"Cache read from Redis failed: {str(e)}")
+            return None
+
+    def set(self, key: str, value: bytes, ttl: Optional[int] = None):
+        if len(value) > self.max_item_bytes:
+            return
+        try:
+            get_redis().set(f"{self.namespace}:{key}", value, ex=ttl or self.default_ttl)
+        except redis.RedisError as e:
+            logger.warning(f"Cache write to Redis failed: {str(e)}")
+
+def build_backend(kind: str, namespace: str, max_bytes: int, directory: str = None, default_ttl: int = None) -> CacheBackend:
+    """Create a backend by name: "memory", "disk", "redis" or "none"."""
+    if kind == "memory":
+        return MemoryLRUBackend(max_bytes, default_ttl=default_ttl)
+    if kind == "disk":
+        return DiskBackend(os.path.join(directory, namespace), max_bytes, default_ttl=default_ttl)
+    if kind == "redis":
+        return RedisBackend(namespace, max_item_bytes=max_bytes, default_ttl=default_ttl)
+    if kind == "none":
+        return NullBackend()
+    raise ValueError(f"Unknown cache backend: {kind}")
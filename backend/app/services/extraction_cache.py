@@ -0,0 +1,69 @@
+import functools
+import hashlib
+import threading
+from collections import defaultdict
+from loguru import logger
+from app.config import settings
+from app.services.cache_backends import build_backend
+
+_backend = None
+_backend_lock = threading.Lock()
+_stats = defaultdict(lambda: {"hits": 0, "misses": 0})
+_stats_lock = threading.Lock()
+
+def _count(extractor: str, outcome: str):
+    # Pipeline extraction threads update these concurrently
+    with _stats_lock:
+        _stats[extractor][outcome] += 1
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = build_backend(
+                    settings.EXTRACTION_CACHE_BACKEND,
+                    namespace="extraction",
+                    max_bytes=settings.EXTRACTION_CACHE_MAX_BYTES,
+                    directory=settings.EXTRACTION_CACHE_DIR,
+                    default_ttl=settings.EXTRACTION_CACHE_TTL,
+                )
+    return _backend
+
+def cache_key(extractor: str, version: str, data: bytes) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{extractor}-{version}-{digest}"
+
+def cached_extraction(extractor: str, version: str):
+    """
+    Cache an extractor's text output by the SHA-256 of its input bytes (or
+    UTF-8 text). Bump version whenever the extractor's output would change.
+    Empty results are not cached so transient failures get retried.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(data, *args, **kwargs):
+            raw = data.encode("utf-8") if isinstance(data, str) else data
+            if not raw or args or kwargs:
+                return func(data, *args, **kwargs)
+            key = cache_key(extractor, version, raw)
+            backend = get_backend()
+            cached = backend.get(key)
+            if cached is not None:
+                _count(extractor, "hits")
+                return cached.decode("utf-8")
+            _count(extractor, "misses")
+            text = func(data)
+            if text:
+                try:
+                    backend.set(key, text.encode("utf-8"))
+                except Exception as e:
+                    logger.warning(f"Failed to cache {extractor} result: {str(e)}")
+            return text
+        return wrapper
+    return decorator
+
+def get_stats() -> dict:
+    """Hit/miss counters per extractor for this process."""
+    with _stats_lock:
+        return {extractor: dict(counts) for extractor, counts in _stats.items()}
@@ -0,0 +1,149 @@
+import os
+import threading
+from loguru import logger
+from app.config import settings
+
+try:
+    # Celery's fork of multiprocessing: unlike the stdlib it lets the daemonic
+    # prefork worker processes start children of their own
+    import billiard as mp
+except ImportError:
+    import multiprocessing as mp
+
+def _available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _limit_memory(limit_mb: int):
+    """Cap the worker's address space so a pathological file fails alone (pdftotext/tesseract inherit it)."""
+    if not limit_mb:
+        return
+    try:
+        import resource
+        limit = limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ImportError, ValueError, OSError) as e:
+        logger.warning(f"Could not set extraction memory limit: {e}")
+
+def _worker_main(conn, memory_limit_mb: int):
+    """Run (func, args) jobs from conn one at a time, replying (ok, result or error message)."""
+    _limit_memory(memory_limit_mb)
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, OSError):
+            return
+        if job is None:
+            return
+        func, args = job
+        try:
+            reply = (True, func(*args))
+        except BaseException as e:
+            reply = (False, f"{type(e).__name__}: {e}")
+        conn.send(reply)
+
+class _Worker:
+    """One extraction process and the pipe it takes jobs on."""
+
+    def __init__(self, context, memory_limit_mb: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        try:
+            self.conn.close()
+        except OSError:
+            pass
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join(1)
+
+class ExtractionExecutor:
+    """
+    Pool of worker processes for CPU-bound extraction (PDF parsing, OCR).
+    Each worker runs one job at a time with a timeout and a memory cap; a job
+    that hangs or crashes gets only its own worker killed and replaced, and
+    returns the default instead of taking the sync task down. Falls back to
+    running inline if worker processes cannot be started.
+    """
+
+    def __init__(self, max_workers: int = None, timeout: float = None, memory_limit_mb: int = None):
+        self.max_workers = max_workers or _available_cores()
+        self.timeout = timeout or settings.EXTRACTION_TIMEOUT
+        self.memory_limit_mb = memory_limit_mb if memory_limit_mb is not None else settings.EXTRACTION_MEMORY_LIMIT_MB
+        self.inline = not settings.EXTRACTION_POOL_ENABLED
+        # forkserver avoids forking a process that is running pipeline threads
+        method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        self._context = mp.get_context(method)
+        self._slots = threading.Semaphore(self.max_workers)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.stop()
+        return _Worker(self._context, self.memory_limit_mb)
+
+    def _checkin(self, worker: _Worker):
+        with self._lock:
+            self._idle.append(worker)
+
+    def run(self, func, *args, default=""):
+        """Run func(*args) in a worker process and wait for it, returning default on timeout, crash or error."""
+        if self.inline:
+            return func(*args)
+        with self._slots:
+            try:
+                worker = self._checkout()
+            except (AssertionError, OSError, RuntimeError) as e:
+                logger.warning(f"Extraction pool unavailable, running inline: {e}")
+                self.inline = True
+                return func(*args)
+
+            try:
+                worker.conn.send((func, args))
+                if not worker.conn.poll(self.timeout):
+                    logger.error(f"{func.__name__} exceeded {self.timeout}s; restarting its extraction worker")
+                    worker.stop()
+                    return default
+                ok, result = worker.conn.recv()
+            except (EOFError, OSError):
+                logger.error(f"Extraction worker crashed in {func.__name__}; restarting it")
+                worker.stop()
+                return default
+            self._checkin(worker)
+
+        if ok:
+            return result
+        if result.startswith("MemoryError"):
+            logger.error(f"{func.__name__} exceeded the {self.memory_limit_mb} MB memory limit")
+        else:
+            logger.error(f"{func.__name__} failed in extraction worker: {result}")
+        return default
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for worker in workers:
+            worker.stop()
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> ExtractionExecutor:
+    """Process-wide executor; rebuilt after a fork so workers are never shared between processes."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ExtractionExecutor()
+            _executor_pid = os.getpid()
+        return _executor
@@ -1,12 +1,40 @@
 import base64
+import json
 import re
+import time
+import uuid
 import requests
+from app.services import http_client
+from urllib.parse import quote
 from loguru import logger
 from app.config import settings
 
 GMAIL_API_BASE = "https://gmail.googleapis.com/gmail/v1"
+GMAIL_BATCH_URL = "https://gmail.googleapis.com/batch/gmail/v1"
+GMAIL_BATCH_LIMIT = 50  # Larger batches are accepted but get throttled by Gmail
+RETRYABLE_BATCH_STATUSES = {429, 500, 502, 503, 504}
+
+def _parts_mask(depth: int) -> str:
+    fields = "partId,mimeType,filename,body/attachmentId,body/size"
+    return fields if depth == 0 else f"{fields},parts({_parts_mask(depth - 1)})"
+
+# Everything triage needs (headers, labels, snippet, size and the MIME part list)
+# without inline bodies. format=metadata would drop the part list altogether,
+# so triage masks a format=full response instead.
+TRIAGE_FIELDS = f"id,threadId,labelIds,snippet,sizeEstimate,payload(mimeType,headers,body/size,parts({_parts_mask(4)}))"
+
+# Labels of messages that never carry incoming bills
+SKIPPED_HISTORY_LABELS = {"DRAFT", "SENT", "SPAM", "TRASH"}
+
+class HistoryExpiredError(Exception):
+    """The stored historyId is older than Gmail keeps history for; a full sync is required."""
+    pass
 
 def refresh_access_token(refresh_token: str) -> str:
+    return refresh_access_token_info(refresh_token)["access_token"]
+
+def refresh_access_token_info(refresh_token: str) -> dict:
+    """Refresh the access token and return Google's full token response (access_token, expires_in, ...)."""
     data = {
         "client_id": settings.GOOGLE_CLIENT_ID,
         "client_secret": settings.GOOGLE_CLIENT_SECRET,
@@ -15,7 +43,7 @@ def refresh_access_token(refresh_token: str) -> str:
     }
     try:
         logger.debug(f"Refreshing access token with client_id: {settings.GOOGLE_CLIENT_ID[:5]}...")
-        resp = requests.post("https://oauth2.googleapis.com/token", data=data)
+        resp = http_client.post("https://oauth2.googleapis.com/token", data=data)
         
         if not resp.ok:
             logger.error(f"Token refresh failed with status {resp.status_code}: {resp.text}")
@@ -33,55 +61,126 @@ def refresh_access_token(refresh_token: str) -> str:
         if "expires_in" in token_info:
             logger.info(f"Token expires in {token_info['expires_in']} seconds")
             
-        return access_token
+        return token_info
     except Exception as e:
         logger.exception(f"Error refreshing token: {str(e)}")
         raise
 
-def list_message_ids(access_token: str, query: str = None, max_results: int = 50):
+def iter_message_id_pages(access_token: str, query: str = None, page_size: int = 100, max_results: int = None):
+    """
+    Yield lists of message IDs one Gmail page at a time, following nextPageToken
+    until the mailbox is exhausted or max_results IDs have been yielded.
+    """
     url = f"{GMAIL_API_BASE}/users/me/messages"
-    params = {}
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params = {"maxResults": page_size}
     if query:
         params["q"] = query
-    if max_results:
-        params["maxResults"] = max_results
+    yielded = 0
+    page = 0
+
+    while True:
+        if max_results:
+            params["maxResults"] = min(page_size, max_results - yielded)
+        try:
+            logger.debug(f"Making Gmail API request to: {url} with query: {query} (page {page + 1})")
+            resp = http_client.get(url, params=params, headers=headers)
+            
+            # Log detailed information about the response
+            if not resp.ok:
+                logger.error(f"Gmail API error: {resp.status_code} - {resp.reason}")
+                logger.error(f"Response content: {resp.text}")
+                
+            resp.raise_for_status()
+            data = resp.json()
+        except requests.exceptions.RequestException as e:
+            logger.exception(f"Request failed: {str(e)}")
+            raise
+
+        page += 1
+        message_ids = [msg["id"] for msg in data.get("messages", [])]
+        if message_ids:
+            yielded += len(message_ids)
+            logger.info(f"Listed page {page} with {len(message_ids)} messages ({yielded} so far)")
+            yield message_ids
+        elif page == 1:
+            logger.warning("No messages found matching the query criteria")
+
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            break
+        if max_results and yielded >= max_results:
+            logger.info(f"Reached listing cap of {max_results} messages")
+            break
+        params["pageToken"] = page_token
+
+def list_message_ids(access_token: str, query: str = None, max_results: int = 50):
+    message_ids = []
+    for page in iter_message_id_pages(access_token, query=query, page_size=min(max_results or 100, 500), max_results=max_results):
+        message_ids.extend(page)
+    return message_ids
+
+def get_profile(access_token: str) -> dict:
+    url = f"{GMAIL_API_BASE}/users/me/profile"
     headers = {"Authorization": f"Bearer {access_token}"}
-    
-    try:
-        logger.debug(f"Making Gmail API request to: {url} with query: {query}")
-        resp = requests.get(url, params=params, headers=headers)
-        
-        # Log detailed information about the response
+    resp = http_client.get(url, headers=headers)
+    if not resp.ok:
+        logger.error(f"Failed to fetch Gmail profile: {resp.status_code} - {resp.text}")
+    resp.raise_for_status()
+    return resp.json()
+
+def list_history_message_ids(access_token: str, start_history_id: str):
+    """
+    Return (message_ids, latest_history_id) for messages added since start_history_id.
+    Raises HistoryExpiredError when Gmail no longer has history that far back.
+    """
+    url = f"{GMAIL_API_BASE}/users/me/history"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params = {"startHistoryId": start_history_id, "historyTypes": "messageAdded"}
+    message_ids = []
+    seen = set()
+    latest_history_id = start_history_id
+
+    while True:
+        logger.debug(f"Fetching Gmail history since {start_history_id}")
+        resp = http_client.get(url, params=params, headers=headers)
+        if resp.status_code == 404:
+            raise HistoryExpiredError(f"History ID {start_history_id} is no longer available")
         if not resp.ok:
-            logger.error(f"Gmail API error: {resp.status_code} - {resp.reason}")
-            logger.error(f"Response content: {resp.text}")
-            
+            logger.error(f"Gmail history error: {resp.status_code} - {resp.text}")
         resp.raise_for_status()
-        
+
         data = resp.json()
-        messages = data.get("messages", [])
-        
-        if not messages:
-            logger.warning("No messages found matching the query criteria")
-        else:
-            logger.info(f"Found {len(messages)} messages matching query")
-            
-        return [msg['id'] for msg in messages]
-    except requests.exceptions.RequestException as e:
-        logger.exception(f"Request failed: {str(e)}")
-        raise
-    except Exception as e:
-        logger.exception(f"Error in list_message_ids: {str(e)}")
-        raise
+        latest_history_id = data.get("historyId", latest_history_id)
+        for record in data.get("history", []):
+            for added in record.get("messagesAdded", []):
+                message = added.get("message", {})
+                msg_id = message.get("id")
+                if not msg_id or msg_id in seen:
+                    continue
+                if SKIPPED_HISTORY_LABELS.intersection(message.get("labelIds", [])):
+                    continue
+                seen.add(msg_id)
+                message_ids.append(msg_id)
+
+        page_token = data.get("nextPageToken")
+        if not page_token:
+            break
+        params["pageToken"] = page_token
 
-def get_message(access_token: str, message_id: str):
+    logger.info(f"Found {len(message_ids)} messages added since history ID {start_history_id}")
+    return message_ids, latest_history_id
+
+def get_message(access_token: str, message_id: str, fields: str = None):
     url = f"{GMAIL_API_BASE}/users/me/messages/{message_id}"
     headers = {"Authorization": f"Bearer {access_token}"}
     params = {"format": "full"}
+    if fields:
+        params["fields"] = fields
     
     try:
         logger.debug(f"Fetching message with ID: {message_id}")
-        resp = requests.get(url, params=params, headers=headers)
+        resp = http_client.get(url, params=params, headers=headers)
         
         if not resp.ok:
             logger.error(f"Failed to fetch message {message_id}: {resp.status_code} - {resp.text}")
@@ -112,13 +211,150 @@ def get_attachments_info(message: dict):
 def download_attachment(access_token: str, message_id: str, attachment_id: str):
     url = f"{GMAIL_API_BASE}/users/me/messages/{message_id}/attachments/{attachment_id}"
     headers = {"Authorization": f"Bearer {access_token}"}
-    resp = requests.get(url, headers=headers)
+    resp = http_client.get(url, headers=headers)
     resp.raise_for_status()
     data = resp.json().get("data")
     if data:
         return base64.urlsafe_b64decode(data + '==')
     return None
 
+def get_header(message: dict, name: str):
+    for header in message.get("payload", {}).get("headers", []):
+        if header.get("name", "").lower() == name.lower():
+            return header.get("value")
+    return None
+
+def _build_batch_body(calls: dict, boundary: str) -> str:
+    parts = []
+    for call_id, path in calls.items():
+        parts.append(
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <{call_id}>\r\n\r\n"
+            f"GET {path}\r\n\r\n"
+        )
+    parts.append(f"--{boundary}--")
+    return "".join(parts)
+
+def _parse_batch_response(resp) -> dict:
+    """Split a multipart/mixed batch response into {call_id: (status, headers, body)}."""
+    match = re.search(r'boundary="?([^";]+)"?', resp.headers.get("Content-Type", ""))
+    if not match:
+        raise ValueError("Batch response has no multipart boundary")
+    boundary = match.group(1)
+    results = {}
+    for part in resp.text.replace("\r\n", "\n").split(f"--{boundary}"):
+        part = part.strip()
+        if not part or part == "--":
+            continue
+        outer_headers, _, http_message = part.partition("\n\n")
+        id_match = re.search(r"Content-ID:\s*<response-(.+?)>", outer_headers, re.IGNORECASE)
+        if not id_match:
+            continue
+        head, _, body = http_message.partition("\n\n")
+        head_lines = head.split("\n")
+        status = int(head_lines[0].split()[1])
+        headers = {}
+        for line in head_lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        results[id_match.group(1)] = (status, headers, body.strip())
+    return results
+
+def _retry_after_seconds(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def execute_batch(access_token: str, calls: dict, max_retries: int = 3) -> dict:
+    """
+    Send GET calls ({call_id: path}) as one Gmail batch request and return
+    {call_id: parsed JSON} for the calls that succeeded. Parts that come back
+    with 429 or 5xx are retried on their own with backoff; other failures are
+    logged and left out of the result.
+    """
+    headers = {"Authorization": f"Bearer {access_token}"}
+    pending = dict(calls)
+    results = {}
+
+    for attempt in range(max_retries + 1):
+        boundary = f"batch_{uuid.uuid4().hex}"
+        batch_headers = dict(headers, **{"Content-Type": f"multipart/mixed; boundary={boundary}"})
+        resp = http_client.post(GMAIL_BATCH_URL, data=_build_batch_body(pending, boundary).encode("utf-8"), headers=batch_headers)
+
+        retry_after = 0
+        if resp.status_code in RETRYABLE_BATCH_STATUSES:
+            logger.warning(f"Gmail batch request failed with {resp.status_code} (try {attempt + 1}/{max_retries + 1})")
+            retry_after = _retry_after_seconds(resp.headers.get("Retry-After"))
+        else:
+            if not resp.ok:
+                logger.error(f"Gmail batch request failed: {resp.status_code} - {resp.text}")
+            resp.raise_for_status()
+
+            parts = _parse_batch_response(resp)
+            retry = {}
+            for call_id, path in pending.items():
+                if call_id not in parts:
+                    # Parts missing from the response are retried like throttled ones
+                    retry[call_id] = path
+                    continue
+                status, part_headers, body = parts[call_id]
+                if status == 200:
+                    results[call_id] = json.loads(body)
+                elif status in RETRYABLE_BATCH_STATUSES:
+                    retry[call_id] = path
+                    retry_after = max(retry_after, _retry_after_seconds(part_headers.get("retry-after")))
+                else:
+                    logger.error(f"Gmail batch call {path} failed: {status} - {body[:200]}")
+            pending = retry
+
+        if not pending:
+            break
+        if attempt < max_retries:
+            sleep_time = max(retry_after, 2 ** attempt)
+            logger.info(f"Retrying {len(pending)} Gmail batch calls in {sleep_time} seconds...")
+            time.sleep(sleep_time)
+
+    if pending:
+        logger.error(f"Giving up on {len(pending)} Gmail batch calls after {max_retries} retries")
+    return results
+
+def batch_get_messages(access_token: str, message_ids: list, format: str = "full", batch_size: int = GMAIL_BATCH_LIMIT,
+                       fields: str = None) -> dict:
+    """Fetch messages through the batch endpoint, returning {message_id: message}. fields is an optional partial-response mask."""
+    messages = {}
+    query = f"format={format}" + (f"&fields={quote(fields, safe='')}" if fields else "")
+    for i in range(0, len(message_ids), batch_size):
+        chunk = message_ids[i:i + batch_size]
+        calls = {
+            str(index): f"/gmail/v1/users/me/messages/{quote(msg_id)}?{query}"
+            for index, msg_id in enumerate(chunk)
+        }
+        logger.debug(f"Fetching {len(chunk)} messages in one batch request")
+        for call_id, message in execute_batch(access_token, calls).items():
+            messages[chunk[int(call_id)]] = message
+    return messages
+
+def batch_download_attachments(access_token: str, attachment_refs: list, batch_size: int = 10) -> dict:
+    """
+    Download attachments given as (message_id, attachment_id) pairs through the
+    batch endpoint, returning {(message_id, attachment_id): bytes}.
+    """
+    attachments = {}
+    for i in range(0, len(attachment_refs), batch_size):
+        chunk = attachment_refs[i:i + batch_size]
+        calls = {
+            str(index): f"/gmail/v1/users/me/messages/{quote(msg_id)}/attachments/{quote(att_id)}"
+            for index, (msg_id, att_id) in enumerate(chunk)
+        }
+        logger.debug(f"Downloading {len(chunk)} attachments in one batch request")
+        for call_id, body in execute_batch(access_token, calls).items():
+            data = body.get("data")
+            if data:
+                attachments[chunk[int(call_id)]] = base64.urlsafe_b64decode(data + '==')
+    return attachments
+
 def extract_urls_from_text(text: str) -> list:
     url_regex = r'https?://[^\s]+'
     return re.findall(url_regex, text)
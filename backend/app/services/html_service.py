@@ -1,5 +1,9 @@
 from bs4 import BeautifulSoup
+from app.services.extraction_cache import cached_extraction
 
+EXTRACTOR_VERSION = "1"
+
+@cached_extraction("html", EXTRACTOR_VERSION)
 def extract_text_from_html(html_content: str) -> str:
     try:
         soup = BeautifulSoup(html_content, "html.parser")
@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from typing import Callable, List
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from loguru import logger
+from app.config import settings
+
+# Called as hook(method, url, status_code, elapsed_seconds) after every request;
+# status_code is None when the request raised.
+LatencyHook = Callable[[str, str, int, float], None]
+
+_latency_hooks: List[LatencyHook] = []
+_sessions = {}  # kind -> (pid, session)
+_session_lock = threading.Lock()
+
+def add_latency_hook(hook: LatencyHook):
+    _latency_hooks.append(hook)
+
+def remove_latency_hook(hook: LatencyHook):
+    if hook in _latency_hooks:
+        _latency_hooks.remove(hook)
+
+def _log_slow_request(method: str, url: str, status_code, elapsed: float):
+    if elapsed >= settings.HTTP_SLOW_REQUEST_SECONDS:
+        logger.warning(f"Slow HTTP call: {method} {url.split('?')[0]} -> {status_code} in {elapsed:.2f}s")
+
+add_latency_hook(_log_slow_request)
+
+class PooledSession(requests.Session):
+    """Session that applies a default timeout and reports each call's latency to the registered hooks."""
+
+    def __init__(self, timeout):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        start = time.perf_counter()
+        status_code = None
+        try:
+            resp = super().request(method, url, **kwargs)
+            status_code = resp.status_code
+            return resp
+        finally:
+            elapsed = time.perf_counter() - start
+            for hook in list(_latency_hooks):
+                try:
+                    hook(method, url, status_code, elapsed)
+                except Exception as e:
+                    logger.error(f"HTTP latency hook failed: {str(e)}")
+
+class CappedRetry(Retry):
+    """Retry whose Retry-After waits are capped, so one throttled host can't stall a worker for hours."""
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, settings.HTTP_RETRY_AFTER_MAX)
+
+def _build_session(max_retries, timeout) -> PooledSession:
+    adapter = HTTPAdapter(
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+        max_retries=max_retries,
+    )
+    session = PooledSession(timeout=timeout)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def _build_api_session() -> PooledSession:
+    # POSTs are left to their callers: the OAuth code exchange is single use and
+    # Gmail batch requests are retried per part by gmail_service.execute_batch
+    retry = CappedRetry(
+        total=settings.HTTP_MAX_RETRIES,
+        backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    return _build_session(retry, (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT))
+
+def _build_link_session() -> PooledSession:
+    # Arbitrary hosts linked from email bodies: one short attempt each
+    return _build_session(0, (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_LINK_TIMEOUT))
+
+def _get_session(kind: str, build) -> PooledSession:
+    entry = _sessions.get(kind)
+    if entry is None or entry[0] != os.getpid():
+        with _session_lock:
+            entry = _sessions.get(kind)
+            if entry is None or entry[0] != os.getpid():
+                entry = (os.getpid(), build())
+                _sessions[kind] = entry
+    return entry[1]
+
+def get_session() -> PooledSession:
+    """
+    Return the process-wide session for Google APIs. Connections are kept
+    alive and pooled per host; a new session is built after a fork (Celery
+    prefork workers) so sockets are never shared between processes.
+    """
+    return _get_session("api", _build_api_session)
+
+def get_link_session() -> PooledSession:
+    """Process-wide session for fetching links found in emails, without retries."""
+    return _get_session("link", _build_link_session)
+
+def get(url: str, **kwargs) -> requests.Response:
+    return get_session().get(url, **kwargs)
+
+def post(url: str, **kwargs) -> requests.Response:
+    return get_session().post(url, **kwargs)
+
+def get_link(url: str, **kwargs) -> requests.Response:
+    return get_link_session().get(url, **kwargs)
@@ -1,12 +1,143 @@
+import os
+import re
 import pytesseract
-from PIL import Image
+from PIL import Image, ImageOps
+from loguru import logger
 import io
+from concurrent.futures import ThreadPoolExecutor
+from app.config import settings
+from app.services.extraction_cache import cached_extraction
+from app.services.extraction_executor import get_executor
 
+EXTRACTOR_VERSION = "2"
+
+# Several Tesseract processes run side by side (pool workers, tiles); stop each
+# one from also spreading over every core with OpenMP
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
+TARGET_DPI = 300
+# Without DPI metadata, aim for a long side typical of a 300 DPI A4 scan
+TARGET_LONG_SIDE = 3300
+# Lower DPI values are screen and camera defaults (72, 96), not scan resolutions
+MIN_TRUSTED_DPI = 150
+SCRIPT_LANGS = {"Latin": "eng", "Hebrew": "heb"}
+
+@cached_extraction("ocr", EXTRACTOR_VERSION)
 def extract_text_from_image(image_bytes: bytes) -> str:
+    return get_executor().run(ocr_image_bytes, image_bytes)
+
+def ocr_image_bytes(image_bytes: bytes) -> str:
+    """OCR in the current process (the extraction pool, or PDF extraction for scanned pages)."""
     try:
         image = Image.open(io.BytesIO(image_bytes))
-        text = pytesseract.image_to_string(image, lang="eng+heb")
-        return text
+        if _is_too_small(image):
+            # Logos, social icons and tracking pixels never carry bill text
+            return ""
+        image = preprocess_image(image)
+        if image is None:
+            return ""
+        lang = detect_language(image)
+        tiles = _split_tiles(image)
+        if len(tiles) == 1:
+            return _ocr(image, lang)
+        with ThreadPoolExecutor(max_workers=settings.OCR_TILE_WORKERS) as pool:
+            return "\n".join(pool.map(lambda tile: _ocr(tile, lang), tiles))
     except Exception as e:
-        print("OCR extraction error:", e)
+        logger.error(f"OCR extraction error: {str(e)}")
         return ""
+
+def _is_too_small(image: Image.Image) -> bool:
+    width, height = image.size
+    return min(width, height) < settings.OCR_MIN_SIDE or width * height < settings.OCR_MIN_AREA
+
+def preprocess_image(image: Image.Image):
+    """
+    Grayscale, rescale to ~300 DPI, crop blank borders and binarize.
+    Returns None when nothing but background is left.
+    """
+    image = ImageOps.exif_transpose(image).convert("L")
+
+    dpi = image.info.get("dpi", (0, 0))[0]
+    if dpi and dpi >= MIN_TRUSTED_DPI:
+        scale = TARGET_DPI / dpi
+    else:
+        scale = TARGET_LONG_SIDE / max(image.size)
+    # Never upscale past the target long side; a bigger image only makes OCR slower
+    scale = min(max(scale, 0.5), 3.0, max(1.0, TARGET_LONG_SIDE / max(image.size)))
+    if abs(scale - 1.0) > 0.1:
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+
+    threshold = _otsu_threshold(image)
+    image = image.point(lambda p: 255 if p > threshold else 0)
+
+    # Crop white margins, keeping a little padding which Tesseract prefers
+    bbox = ImageOps.invert(image).getbbox()
+    if bbox is None:
+        return None
+    pad = 10
+    left, top, right, bottom = bbox
+    image = image.crop((max(0, left - pad), max(0, top - pad), min(image.width, right + pad), min(image.height, bottom + pad)))
+    if _is_too_small(image):
+        return None
+    return image
+
+def _otsu_threshold(image: Image.Image) -> int:
+    histogram = image.histogram()
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background = 0
+    weight_background = 0
+    best_threshold, best_variance = 127, 0.0
+    for i, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += i * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = i, variance
+    return best_threshold
+
+def detect_language(image: Image.Image) -> str:
+    """Pick a single Tesseract model when OSD is confident about the script, else load both."""
+    try:
+        osd = pytesseract.image_to_osd(image, config="--psm 0")
+    except pytesseract.TesseractError:
+        # Usually "too few characters" for OSD; not worth a second guess
+        return "eng+heb"
+    script = re.search(r"Script:\s*(\w+)", osd)
+    confidence = re.search(r"Script confidence:\s*([\d.]+)", osd)
+    if script and confidence and float(confidence.group(1)) >= settings.OCR_SCRIPT_MIN_CONFIDENCE:
+        return SCRIPT_LANGS.get(script.group(1), "eng+heb")
+    return "eng+heb"
+
+def _split_tiles(image: Image.Image) -> list:
+    """Cut tall scans into horizontal strips at blank rows so tiles can be OCRed in parallel."""
+    tile_height = settings.OCR_TILE_HEIGHT
+    if image.height <= tile_height * 1.5:
+        return [image]
+    tiles = []
+    top = 0
+    while image.height - top > tile_height * 1.5:
+        cut = _find_blank_row(image, top + tile_height)
+        tiles.append(image.crop((0, top, image.width, cut)))
+        top = cut
+    tiles.append(image.crop((0, top, image.width, image.height)))
+    return tiles
+
+def _find_blank_row(image: Image.Image, target: int, search: int = 150) -> int:
+    # Prefer a row without ink near the target so no text line is cut in half
+    for offset in range(search):
+        for y in (target + offset, target - offset):
+            if 0 < y < image.height and image.crop((0, y, image.width, y + 1)).getextrema()[0] == 255:
+                return y
+    return target
+
+def _ocr(image: Image.Image, lang: str) -> str:
+    return pytesseract.image_to_string(image, lang=lang, config=f"--dpi {TARGET_DPI}")
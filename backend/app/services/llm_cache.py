@@ -0,0 +1,66 @@
+import hashlib
+import json
+import re
+import threading
+from typing import Any, Optional
+from loguru import logger
+from app.config import settings
+from app.services.cache_backends import build_backend
+
+_backend = None
+_backend_lock = threading.Lock()
+stats = {"hits": 0, "misses": 0}
+_stats_lock = threading.Lock()
+
+def _count(outcome: str):
+    with _stats_lock:
+        stats[outcome] += 1
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = build_backend(
+                    settings.LLM_CACHE_BACKEND,
+                    namespace="llm",
+                    max_bytes=settings.LLM_CACHE_MAX_BYTES,
+                    directory=settings.EXTRACTION_CACHE_DIR,
+                    default_ttl=settings.LLM_CACHE_TTL,
+                )
+    return _backend
+
+def normalize_text(text: str) -> str:
+    """Whitespace-insensitive form of an input text, so reflowed copies of the same email share a key."""
+    return re.sub(r"\s+", " ", text or "").strip()
+
+def make_key(kind: str, system_prompt: str, input_text: str, params: dict) -> str:
+    """Hash of everything that determines a deterministic completion."""
+    material = json.dumps({
+        "kind": kind,
+        "endpoint": settings.AZURE_OPENAI_ENDPOINT,
+        "engine": settings.AZURE_OPENAI_ENGINE,
+        "api_version": settings.AZURE_OPENAI_API_VERSION,
+        "system": normalize_text(system_prompt),
+        "input": normalize_text(input_text),
+        "params": params,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def get(key: str) -> Optional[Any]:
+    try:
+        cached = get_backend().get(key)
+    except Exception as e:
+        logger.warning(f"LLM cache read failed: {str(e)}")
+        cached = None
+    if cached is None:
+        _count("misses")
+        return None
+    _count("hits")
+    return json.loads(cached.decode("utf-8"))
+
+def put(key: str, value: Any):
+    try:
+        get_backend().set(key, json.dumps(value, ensure_ascii=False).encode("utf-8"))
+    except Exception as e:
+        logger.warning(f"LLM cache write failed: {str(e)}")
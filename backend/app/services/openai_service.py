@@ -6,6 +6,9 @@ import time
 import re
 from typing import List, Dict, Any, Optional
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
+from app.services import llm_cache, rule_extractor, prompt_compactor, bill_normalizer
+from app.services.rate_limiter import TokenBucketLimiter
+from app.services.batch_planner import count_tokens
 
 # Handle different OpenAI package structures across versions
 try:
@@ -36,6 +39,13 @@ client = AzureOpenAI(
     api_version=settings.AZURE_OPENAI_API_VERSION
 )
 
+rate_limiter = TokenBucketLimiter(
+    settings.AZURE_OPENAI_ENGINE,
+    tokens_per_minute=settings.AZURE_OPENAI_TPM,
+    requests_per_minute=settings.AZURE_OPENAI_RPM,
+    max_wait=settings.AZURE_OPENAI_RATE_LIMIT_MAX_WAIT,
+)
+
 @retry(
     stop=stop_after_attempt(5),
     wait=wait_exponential(multiplier=1, min=1, max=10),
@@ -45,17 +55,59 @@ client = AzureOpenAI(
 def call_openai_with_retry(*args, **kwargs):
     """
     Wrapper for OpenAI API calls with retry logic.
+    Reserves TPM/RPM budget from the shared rate limiter before each attempt
+    and reconciles it against the reported usage afterwards.
     Retries on RateLimitError and APIError with exponential backoff.
     """
+    reserved = rate_limiter.reserve(estimate_request_tokens(kwargs))
     try:
         response = client.chat.completions.create(*args, **kwargs)
-        return response
     except RateLimitError as e:
+        rate_limiter.reconcile(reserved, 0)
         logger.warning(f"Rate limit hit: {e}. Retrying...")
         raise
     except APIError as e:
+        rate_limiter.reconcile(reserved, 0)
         logger.warning(f"API error: {e}. Retrying...")
         raise
+    usage = getattr(response, "usage", None)
+    if usage is not None and getattr(usage, "total_tokens", None) is not None:
+        rate_limiter.reconcile(reserved, usage.total_tokens)
+    return response
+
+def estimate_request_tokens(request: dict) -> int:
+    """Upper-bound estimate of a chat request's quota cost: prompt tokens plus the completion limit."""
+    prompt_tokens = sum(estimate_token_count(m.get("content") or "") for m in request.get("messages", []))
+    return prompt_tokens + request.get("max_tokens", 0)
+
+def cached_chat_completion(**kwargs) -> str:
+    """
+    Return the completion content for a chat request, serving identical
+    deterministic (temperature 0) requests from the LLM response cache.
+    Only responses that parse as JSON are cached.
+    """
+    messages = kwargs.get("messages", [])
+    system_prompt = "\n".join(m["content"] for m in messages if m["role"] == "system")
+    input_text = "\n".join(m["content"] for m in messages if m["role"] != "system")
+    params = {k: v for k, v in kwargs.items() if k != "messages"}
+    cacheable = kwargs.get("temperature") == 0.0
+    key = llm_cache.make_key("chat", system_prompt, input_text, params) if cacheable else None
+
+    if key:
+        cached = llm_cache.get(key)
+        if cached is not None:
+            logger.debug("Serving OpenAI response from cache")
+            return cached
+
+    response = call_openai_with_retry(**kwargs)
+    content = response.choices[0].message.content
+    if key and content:
+        try:
+            json.loads(content.strip())
+            llm_cache.put(key, content)
+        except json.JSONDecodeError:
+            pass
+    return content
 
 def preprocess_raw_text(text: str) -> str:
     """
@@ -126,7 +178,7 @@ Example 2 (Hebrew):
 """
     user_prompt = f"""Invoice Text:\n{processed_text}\nExtract the data as JSON."""
     try:
-        response = call_openai_with_retry(
+        content = cached_chat_completion(
             model=settings.AZURE_OPENAI_ENGINE,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -136,7 +188,6 @@ Example 2 (Hebrew):
             max_tokens=500,
             response_format={"type": "json_object"}
         )
-        content = response.choices[0].message.content
         
         logger.debug(f"OpenAI raw response: {content[:100]}...")
         
@@ -254,7 +305,7 @@ Example 2 (Hebrew):
     retries = 0
     while retries <= max_retries:
         try:
-            response = call_openai_with_retry(
+            content = cached_chat_completion(
                 model=settings.AZURE_OPENAI_ENGINE,
                 messages=[
                     {"role": "system", "content": system_prompt},
@@ -264,7 +315,6 @@ Example 2 (Hebrew):
                 max_tokens=2000,
                 response_format={"type": "json_object"}
             )
-            content = response.choices[0].message.content
             logger.debug(f"Batch processing raw response: {content[:100]}...")
             
             try:
@@ -322,14 +372,18 @@ def validate_and_clean_bill_data(data: Dict[str, Any]) -> Dict[str, Any]:
                 clean_data[field] = None
             else:
                 clean_data[field] = value
+    # Typed values alongside the raw ones; dates as ISO strings so results stay JSON-cacheable
+    issued_on = bill_normalizer.parse_date(clean_data["date"])
+    due_on = bill_normalizer.parse_date(clean_data["due_date"])
+    clean_data["issued_on"] = issued_on.isoformat() if issued_on else None
+    clean_data["due_on"] = due_on.isoformat() if due_on else None
+    clean_data["currency_code"] = bill_normalizer.normalize_currency(clean_data["currency"])
     return clean_data
 
 def estimate_token_count(text: str) -> int:
-    # Simple estimation: 1 token ≈ 0.75 words
-    return int(len(text.split()) / 0.75)
+    return count_tokens(text)
 
-def extract_bills_data_from_batch(email_texts: List[str]) -> List[Dict[str, Any]]:
-    system_prompt = """
+BATCH_SYSTEM_PROMPT = """
 You are an AI specialized in extracting structured bill information from emails. Each email is delimited clearly. Extract structured data separately for each email. Return a JSON array where each element corresponds to one email.
 
 Extract these fields per email:
@@ -343,20 +397,72 @@ Extract these fields per email:
 
 If information is missing, use null.
 """
+BATCH_REQUEST_PARAMS = {
+    "temperature": 0.0,
+    "max_tokens": settings.LLM_BATCH_COMPLETION_TOKENS,
+    "response_format": {"type": "json_object"},
+}
+BATCH_USER_PROMPT_HEADER = "Extract structured bill data from each email separately:\n\n"
+BATCH_ITEM_OVERHEAD_TOKENS = 16  # The "### Email N Start/End" markers around each email
+
+def batch_prompt_overhead() -> int:
+    """Tokens a batch request spends before any email text."""
+    return count_tokens(BATCH_SYSTEM_PROMPT) + count_tokens(BATCH_USER_PROMPT_HEADER)
+
+def extract_bills_data_from_batch(email_texts: List[str], senders: List[Optional[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Extract bill data for each email, returning one dict per input email.
+    Clearly labelled bills are handled by the rule-based extractor (which also
+    matches vendors on the From header in senders, when given); the rest are
+    cached per email, so only emails not seen before reach the model.
+    """
+    senders = senders or [None] * len(email_texts)
+    results = [None] * len(email_texts)
+    for i, text in enumerate(email_texts):
+        bill, confidence = rule_extractor.extract_bill_fields(text, sender=senders[i])
+        if confidence >= settings.RULE_EXTRACTOR_MIN_CONFIDENCE:
+            results[i] = validate_and_clean_bill_data(bill)
+    remaining = [i for i, result in enumerate(results) if result is None]
+    if len(remaining) < len(email_texts):
+        logger.info(f"{len(email_texts) - len(remaining)} of {len(email_texts)} emails extracted by rules")
+    if not remaining:
+        return results
+
+    params = dict(BATCH_REQUEST_PARAMS, model=settings.AZURE_OPENAI_ENGINE)
+    keys = {i: llm_cache.make_key("batch_email", BATCH_SYSTEM_PROMPT, email_texts[i], params) for i in remaining}
+    for i in remaining:
+        results[i] = llm_cache.get(keys[i])
+    pending = [i for i in remaining if results[i] is None]
+    if not pending:
+        logger.info(f"All {len(remaining)} remaining emails served from the LLM cache")
+        return results
+    if len(pending) < len(remaining):
+        logger.info(f"{len(remaining) - len(pending)} of {len(remaining)} emails served from the LLM cache")
+
+    fresh = _request_bills_batch([email_texts[i] for i in pending])
+    aligned = len(fresh) == len(pending)
+    if not aligned:
+        logger.warning(f"OpenAI returned {len(fresh)} results for {len(pending)} emails; not caching this batch")
+    for i, bill in zip(pending, fresh):
+        results[i] = bill
+        if aligned and bill:
+            llm_cache.put(keys[i], bill)
+    return [result if result is not None else {} for result in results]
+
+def _request_bills_batch(email_texts: List[str]) -> List[Dict[str, Any]]:
+    email_texts = prompt_compactor.strip_shared_boilerplate(email_texts)
     formatted_batch = ""
     for idx, email_text in enumerate(email_texts, 1):
         formatted_batch += f"### Email {idx} Start\n{email_text}\n### Email {idx} End\n\n"
-    user_prompt = f"Extract structured bill data from each email separately:\n\n{formatted_batch}"
+    user_prompt = f"{BATCH_USER_PROMPT_HEADER}{formatted_batch}"
     
     response = call_openai_with_retry(
         model=settings.AZURE_OPENAI_ENGINE,
         messages=[
-            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": BATCH_SYSTEM_PROMPT},
             {"role": "user", "content": user_prompt}
         ],
-        temperature=0.0,
-        max_tokens=2000,
-        response_format={"type": "json_object"}
+        **BATCH_REQUEST_PARAMS
     )
     content = response.choices[0].message.content
     try:
@@ -1,14 +1,111 @@
+import shutil
+import subprocess
+import tempfile
 from io import BytesIO
+from typing import Iterator
 from PyPDF2 import PdfReader
+from loguru import logger
+from app.config import settings
+from app.services import image_service
+from app.services.extraction_cache import cached_extraction
+from app.services.extraction_executor import get_executor
 
+EXTRACTOR_VERSION = "2"
+
+@cached_extraction("pdf", EXTRACTOR_VERSION)
 def extract_text_from_pdf(pdf_bytes: bytes) -> str:
-    text = ""
+    return get_executor().run(_extract_text, pdf_bytes)
+
+def _extract_text(pdf_bytes: bytes) -> str:
+    # Runs inside the extraction process pool
+    segments = []
+    total_chars = 0
     try:
-        reader = PdfReader(BytesIO(pdf_bytes))
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as pdf_file:
+            pdf_file.write(pdf_bytes)
+            pdf_file.flush()
+            for page_number, page_text in enumerate(iter_pdf_pages(pdf_file.name), 1):
+                if not page_text.strip() and settings.PDF_OCR_SCANNED_PAGES:
+                    # No text layer: most likely a scanned page
+                    page_text = _ocr_page(pdf_file.name, page_number)
+                if page_text.strip():
+                    segments.append(page_text)
+                    total_chars += len(page_text)
+                # Bills are decided by the first pages; stop once there is enough text
+                if total_chars >= settings.PDF_MAX_CHARS:
+                    break
     except Exception as e:
-        print("PDF extraction error:", e)
-    return text
+        logger.error(f"PDF extraction error: {str(e)}")
+    return "\n".join(segments)
+
+def iter_pdf_pages(pdf_path: str, backend: str = None, max_pages: int = None) -> Iterator[str]:
+    """
+    Yield the text of each page in order, up to max_pages. Pages without a
+    text layer yield an empty string. Uses poppler's pdftotext when available
+    and PyPDF2 otherwise (or when pdftotext fails before producing a page).
+    """
+    backend = backend or settings.PDF_BACKEND
+    max_pages = max_pages or settings.PDF_MAX_PAGES
+    if backend == "pdftotext" and shutil.which("pdftotext"):
+        yielded = False
+        try:
+            for page_text in _iter_pages_pdftotext(pdf_path, max_pages):
+                yielded = True
+                yield page_text
+            return
+        except (OSError, subprocess.SubprocessError) as e:
+            if yielded:
+                raise
+            logger.warning(f"pdftotext failed, falling back to PyPDF2: {str(e)}")
+    yield from _iter_pages_pypdf2(pdf_path, max_pages)
+
+def _iter_pages_pdftotext(pdf_path: str, max_pages: int) -> Iterator[str]:
+    # pdftotext separates pages with form feeds; read its output as a stream so
+    # the caller can stop early and the process gets killed without finishing
+    proc = subprocess.Popen(
+        ["pdftotext", "-layout", "-enc", "UTF-8", "-l", str(max_pages), pdf_path, "-"],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        buffer = b""
+        while True:
+            chunk = proc.stdout.read(65536)
+            if not chunk:
+                break
+            buffer += chunk
+            *pages, buffer = buffer.split(b"\f")
+            for page in pages:
+                yield page.decode("utf-8", errors="ignore")
+        if proc.wait() != 0:
+            raise subprocess.SubprocessError(f"pdftotext exited with {proc.returncode}")
+        if buffer.strip():
+            yield buffer.decode("utf-8", errors="ignore")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+
+def _iter_pages_pypdf2(pdf_path: str, max_pages: int) -> Iterator[str]:
+    with open(pdf_path, "rb") as f:
+        reader = PdfReader(BytesIO(f.read()))
+    for page in reader.pages[:max_pages]:
+        yield page.extract_text() or ""
+
+def _ocr_page(pdf_path: str, page_number: int) -> str:
+    """Render one page with pdftoppm and OCR it."""
+    if not shutil.which("pdftoppm"):
+        return ""
+    try:
+        result = subprocess.run(
+            ["pdftoppm", "-png", "-r", "300", "-f", str(page_number), "-l", str(page_number), "-singlefile", pdf_path],
+            capture_output=True,
+            timeout=settings.EXTRACTION_TIMEOUT,
+        )
+    except subprocess.SubprocessError as e:
+        logger.error(f"PDF page render error: {str(e)}")
+        return ""
+    if result.returncode != 0 or not result.stdout:
+        return ""
+    return image_service.ocr_image_bytes(result.stdout)
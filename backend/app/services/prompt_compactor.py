@@ -0,0 +1,133 @@
+import re
+from collections import Counter
+from typing import List
+from app.config import settings
+from app.services.batch_planner import count_tokens
+from app.services.rule_extractor import (
+    CURRENCY_PATTERN, DATE_VALUE_PATTERN, STRONG_AMOUNT_LABELS, WEAK_AMOUNT_LABELS, DUE_DATE_LABELS, DATE_LABELS,
+)
+
+# Shrinks an email's combined text (body, attachments, linked pages) to the
+# windows around lines that look like bill data, so the prompt budget goes to
+# amounts, dates and labels rather than footers and marketing copy.
+
+HEADER_LINES = 5  # Letterheads usually name the vendor
+GAP_MARKER = "..."
+
+_LABEL_RE = re.compile(
+    "|".join(re.escape(label) for label in STRONG_AMOUNT_LABELS + WEAK_AMOUNT_LABELS + DUE_DATE_LABELS + DATE_LABELS),
+    re.IGNORECASE,
+)
+_AMOUNT_RE = re.compile(CURRENCY_PATTERN + r"\s*\d|\d[\d,]*(?:\.\d{1,2})?\s*" + CURRENCY_PATTERN, re.IGNORECASE)
+_DATE_RE = re.compile(DATE_VALUE_PATTERN)
+_KEYWORD_RE = re.compile(
+    r"bill|invoice|receipt|account|customer|vat|חשבונית|קבלה|חשבון|לקוח|מע\"מ|מע״מ|ארנונה|חשמל|מים|גז|תקופת",
+    re.IGNORECASE,
+)
+_BOILERPLATE_RE = re.compile(
+    r"unsubscribe|privacy|all rights reserved|©|copyright|this (?:e-?mail|message) (?:was|is)|do not reply|"
+    r"confidential|view (?:it )?in (?:your )?browser|להסרה|כל הזכויות שמורות|אין להשיב|מדיניות פרטיות",
+    re.IGNORECASE,
+)
+
+def score_line(line: str) -> int:
+    score = 0
+    if _AMOUNT_RE.search(line):
+        score += 3
+    if _LABEL_RE.search(line):
+        score += 3
+    if _DATE_RE.search(line):
+        score += 2
+    if _KEYWORD_RE.search(line):
+        score += 1
+    if any(c.isdigit() for c in line):
+        score += 1
+    if _BOILERPLATE_RE.search(line):
+        score -= 3
+    return score
+
+def compact(text: str, max_tokens: int = None) -> str:
+    """
+    Keep the highest-scoring windows of lines (plus the first few lines) within
+    max_tokens, in their original order. Text already within budget is returned as is.
+    """
+    max_tokens = max_tokens or settings.LLM_EMAIL_TOKEN_BUDGET
+    if not text or count_tokens(text) <= max_tokens:
+        return text
+    lines = [line.strip() for line in text.splitlines()]
+    lines = [line for line in lines if line]
+    scores = [score_line(line) for line in lines]
+    for i in range(min(HEADER_LINES, len(lines))):
+        scores[i] += 2
+
+    # Merge the context windows around relevant lines into blocks
+    radius = settings.LLM_COMPACT_WINDOW_LINES
+    blocks = []
+    for i, score in enumerate(scores):
+        if score < 2:
+            continue
+        start, end = max(0, i - radius), min(len(lines), i + radius + 1)
+        if blocks and start <= blocks[-1][1]:
+            blocks[-1][1] = max(blocks[-1][1], end)
+        else:
+            blocks.append([start, end])
+
+    # Densest blocks first, until the budget is spent
+    ranked = sorted(
+        blocks,
+        key=lambda block: sum(max(s, 0) for s in scores[block[0]:block[1]]) / (block[1] - block[0]),
+        reverse=True,
+    )
+    kept = []
+    used = 0
+    for start, end in ranked:
+        tokens = count_tokens("\n".join(lines[start:end])) + 1
+        if used + tokens > max_tokens:
+            continue
+        kept.append((start, end))
+        used += tokens
+
+    if not kept:
+        return text
+    kept.sort()
+    pieces = []
+    previous_end = 0
+    for start, end in kept:
+        if start > previous_end:
+            pieces.append(GAP_MARKER)
+        pieces.extend(lines[start:end])
+        previous_end = end
+    return "\n".join(pieces)
+
+def strip_shared_boilerplate(email_texts: List[str]) -> List[str]:
+    """
+    Drop long, data-free lines that recur across emails of one batch (legal
+    footers, disclaimers), keeping the first occurrence so nothing is lost.
+    """
+    if len(email_texts) < 2:
+        return email_texts
+    min_chars = settings.LLM_BOILERPLATE_MIN_CHARS
+
+    def candidates(text):
+        return {
+            line.strip() for line in text.splitlines()
+            if len(line.strip()) >= min_chars and score_line(line) <= 0
+        }
+
+    counts = Counter(line for text in email_texts for line in candidates(text))
+    shared = {line for line, count in counts.items() if count > 1}
+    if not shared:
+        return email_texts
+    seen = set()
+    result = []
+    for text in email_texts:
+        kept_lines = []
+        for line in text.splitlines():
+            stripped = line.strip()
+            if stripped in shared:
+                if stripped in seen:
+                    continue
+                seen.add(stripped)
+            kept_lines.append(line)
+        result.append("\n".join(kept_lines))
+    return result
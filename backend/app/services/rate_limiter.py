@@ -0,0 +1,109 @@
+import time
+import redis
+from loguru import logger
+from app.redis_client import get_redis
+
+# Both buckets refill continuously at capacity/60 per second. Returns the number
+# of seconds to wait (as a string, Lua numbers are truncated to integers) and
+# only deducts when both buckets can cover the reservation.
+_RESERVE_SCRIPT = """
+local function refill(key, capacity, now)
+    local data = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    return math.min(capacity, level + math.max(0, now - ts) * capacity / 60)
+end
+local now = tonumber(ARGV[1])
+local token_capacity = tonumber(ARGV[2])
+local request_capacity = tonumber(ARGV[3])
+local tokens = tonumber(ARGV[4])
+local requests = tonumber(ARGV[5])
+local token_level = refill(KEYS[1], token_capacity, now)
+local request_level = refill(KEYS[2], request_capacity, now)
+local wait = 0
+if token_level < tokens then
+    wait = math.max(wait, (tokens - token_level) * 60 / token_capacity)
+end
+if request_level < requests then
+    wait = math.max(wait, (requests - request_level) * 60 / request_capacity)
+end
+if wait == 0 then
+    token_level = token_level - tokens
+    request_level = request_level - requests
+end
+redis.call('HSET', KEYS[1], 'level', token_level, 'ts', now)
+redis.call('HSET', KEYS[2], 'level', request_level, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+redis.call('EXPIRE', KEYS[2], 120)
+return tostring(wait)
+"""
+
+# Give back (or take more of) the token budget once the real usage is known.
+_ADJUST_SCRIPT = """
+local now = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local delta = tonumber(ARGV[3])
+local data = redis.call('HMGET', KEYS[1], 'level', 'ts')
+local level = tonumber(data[1]) or capacity
+local ts = tonumber(data[2]) or now
+level = math.min(capacity, level + math.max(0, now - ts) * capacity / 60 + delta)
+redis.call('HSET', KEYS[1], 'level', level, 'ts', now)
+redis.call('EXPIRE', KEYS[1], 120)
+return tostring(level)
+"""
+
+class TokenBucketLimiter:
+    """
+    Cluster-wide limiter for one Azure OpenAI deployment, tracking both its
+    tokens-per-minute and requests-per-minute quotas in Redis so every worker
+    draws from the same budget. Fails open when Redis is unavailable.
+    """
+
+    def __init__(self, name: str, tokens_per_minute: int, requests_per_minute: int, max_wait: float = 120):
+        self.token_key = f"ratelimit:{name}:tpm"
+        self.request_key = f"ratelimit:{name}:rpm"
+        self.tokens_per_minute = tokens_per_minute
+        self.requests_per_minute = requests_per_minute
+        self.max_wait = max_wait
+        self._reserve = None
+        self._adjust = None
+
+    def _scripts(self):
+        if self._reserve is None:
+            r = get_redis()
+            self._reserve = r.register_script(_RESERVE_SCRIPT)
+            self._adjust = r.register_script(_ADJUST_SCRIPT)
+        return self._reserve, self._adjust
+
+    def reserve(self, tokens: int) -> int:
+        """Block until the budget covers one request of `tokens` tokens; returns the amount reserved."""
+        # A single request can never need more than a full minute of quota
+        tokens = min(tokens, self.tokens_per_minute)
+        deadline = time.monotonic() + self.max_wait
+        try:
+            reserve_script, _ = self._scripts()
+            while True:
+                wait = float(reserve_script(
+                    keys=[self.token_key, self.request_key],
+                    args=[time.time(), self.tokens_per_minute, self.requests_per_minute, tokens, 1],
+                ))
+                if wait <= 0:
+                    return tokens
+                if time.monotonic() + wait > deadline:
+                    logger.warning(f"Rate limiter wait exceeded {self.max_wait}s; sending without a reservation")
+                    return 0
+                logger.debug(f"Rate limiter: waiting {wait:.2f}s for {tokens} tokens")
+                time.sleep(wait)
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter unavailable, sending without a reservation: {str(e)}")
+            return 0
+
+    def reconcile(self, reserved: int, actual: int):
+        """Correct the token bucket by the difference between the reservation and real usage."""
+        if reserved == actual:
+            return
+        try:
+            _, adjust_script = self._scripts()
+            adjust_script(keys=[self.token_key], args=[time.time(), self.tokens_per_minute, reserved - actual])
+        except redis.RedisError as e:
+            logger.warning(f"Rate limiter reconcile failed: {str(e)}")
@@ -0,0 +1,180 @@
+import re
+from typing import Any, Dict, Optional, Tuple
+
+# Deterministic extraction for machine-generated bills whose fields are
+# plainly labelled. Produces the same fields as validate_and_clean_bill_data
+# plus a confidence score; callers send low-confidence texts to the LLM.
+
+NUMBER_PATTERN = r"(\d{1,3}(?:,\d{3})+(?:\.\d{1,2})?|\d+(?:\.\d{1,2})?)"
+
+CURRENCIES = {
+    "₪": "ILS", "ש\"ח": "ILS", "ש״ח": "ILS", "שח": "ILS", "שקלים": "ILS", "NIS": "ILS", "ILS": "ILS",
+    "$": "USD", "USD": "USD", "€": "EUR", "EUR": "EUR", "£": "GBP", "GBP": "GBP",
+}
+CURRENCY_PATTERN = "(" + "|".join(re.escape(symbol) for symbol in sorted(CURRENCIES, key=len, reverse=True)) + ")"
+
+# Labels that name the amount actually owed, and generic ones that often do
+STRONG_AMOUNT_LABELS = [
+    "amount due", "total due", "balance due", "amount to pay", "total amount due", "total to pay",
+    "סכום לתשלום", "סה\"כ לתשלום", "סה״כ לתשלום", "סך הכל לתשלום", "סכום החיוב", "סכום החשבון", "יתרה לתשלום",
+]
+WEAK_AMOUNT_LABELS = ["total", "amount", "סה\"כ", "סה״כ", "סכום", "לתשלום"]
+
+DUE_DATE_LABELS = [
+    "due date", "payment due", "pay by", "due on", "payment date",
+    "תאריך אחרון לתשלום", "תאריך לתשלום", "לתשלום עד", "מועד התשלום", "מועד תשלום", "יש לשלם עד",
+]
+DATE_LABELS = [
+    "invoice date", "issue date", "bill date", "statement date", "date",
+    "תאריך הפקה", "תאריך החשבונית", "תאריך חשבונית", "תאריך הוצאה", "תאריך",
+]
+VENDOR_LABELS = ["vendor", "company", "supplier", "from", "ספק", "חברה", "שם העסק", "מאת"]
+
+# Recurring Israeli billers: (pattern, vendor, category). Patterns match
+# case-insensitively, so Latin acronyms that are also English words are
+# pinned to upper case with (?-i:...).
+KNOWN_VENDORS = [
+    (r"חברת החשמל|israel electric|(?-i:IEC)", "חברת החשמל", "utilities"),
+    (r"בזק|bezeq", "בזק", "telecom"),
+    (r"פרטנר|partner communications", "פרטנר", "telecom"),
+    (r"סלקום|cellcom", "סלקום", "telecom"),
+    (r"פלאפון|pelephone", "פלאפון", "telecom"),
+    (r"(?-i:HOT)(?!\s+water)|hot\.net\.il|הוט", "HOT", "telecom"),
+    (r"גולן טלקום|golan telecom", "גולן טלקום", "telecom"),
+    (r"תאגיד המים|מי אביבים|הגיחון|מי שבע|מי כרמל", None, "water"),
+    (r"ארנונה|arnona", None, "municipal tax"),
+    (r"סופרגז|אמישראגז|פזגז|supergas|amisragas|pazgas", None, "gas"),
+]
+CATEGORY_KEYWORDS = [
+    (r"electricity|electric|חשמל", "utilities"),
+    (r"water|מים", "water"),
+    (r"gas|גז", "gas"),
+    (r"ארנונה|property tax|municipal", "municipal tax"),
+    (r"internet|mobile|cellular|סלולר|אינטרנט|טלפון", "telecom"),
+    (r"insurance|ביטוח", "insurance"),
+    (r"rent|שכירות|שכר דירה", "rent"),
+]
+PAID_KEYWORDS = r"receipt|payment received|paid in full|thank you for your payment|קבלה|שולם|התשלום התקבל|אישור תשלום"
+UNPAID_KEYWORDS = r"amount due|balance due|please pay|לתשלום|יש לשלם"
+
+DATE_VALUE_PATTERN = (
+    r"(\d{1,2}[/.\-]\d{1,2}[/.\-]\d{2,4}|\d{4}-\d{2}-\d{2}|"
+    r"\d{1,2}\s+[A-Za-z]{3,9}\.?\s+\d{4}|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4})"
+)
+
+def _labels(labels) -> str:
+    return "(?:" + "|".join(re.escape(label) for label in sorted(labels, key=len, reverse=True)) + ")"
+
+def _compile_amount(labels) -> re.Pattern:
+    return re.compile(
+        _labels(labels) + r"\s*[:\-]?\s*(?:" + CURRENCY_PATTERN + r"\s*)?" + NUMBER_PATTERN + r"(?:\s*" + CURRENCY_PATTERN + r")?",
+        re.IGNORECASE,
+    )
+
+STRONG_AMOUNT_RE = _compile_amount(STRONG_AMOUNT_LABELS)
+WEAK_AMOUNT_RE = _compile_amount(WEAK_AMOUNT_LABELS)
+DUE_DATE_RE = re.compile(_labels(DUE_DATE_LABELS) + r"\s*[:\-]?\s*" + DATE_VALUE_PATTERN, re.IGNORECASE)
+# A generic "date"/"תאריך" label must not be the start of a due-date label
+DATE_RE = re.compile(
+    r"(?<!due )(?<!payment )" + _labels(DATE_LABELS) + r"(?!\s*(?:אחרון\s*)?לתשלום)\s*[:\-]?\s*" + DATE_VALUE_PATTERN,
+    re.IGNORECASE,
+)
+VENDOR_RE = re.compile(r"^\s*" + _labels(VENDOR_LABELS) + r"\s*:\s*(.{2,80}?)\s*$", re.IGNORECASE | re.MULTILINE)
+
+def _compile_words(pattern: str) -> re.Pattern:
+    # Whole words only ("מים" must not match "קיימים"), allowing Hebrew one-letter prefixes
+    return re.compile(r"(?<!\w)[הוכלבמש]?(?:" + pattern + r")(?!\w)", re.IGNORECASE)
+
+KNOWN_VENDOR_RES = [(_compile_words(pattern), vendor, category) for pattern, vendor, category in KNOWN_VENDORS]
+CATEGORY_RES = [(_compile_words(pattern), category) for pattern, category in CATEGORY_KEYWORDS]
+PAID_RE = re.compile(PAID_KEYWORDS, re.IGNORECASE)
+UNPAID_RE = re.compile(UNPAID_KEYWORDS, re.IGNORECASE)
+CURRENCY_RE = re.compile(CURRENCY_PATTERN, re.IGNORECASE)
+SENDER_NAME_RE = re.compile(r'^\s*"?([^"<]+?)"?\s*<[^>]+>\s*$')
+
+def currency_code(symbol: Optional[str]) -> Optional[str]:
+    if not symbol:
+        return None
+    return CURRENCIES.get(symbol.upper() if symbol.isascii() else symbol)
+
+def _parse_amount(value: str) -> Optional[float]:
+    try:
+        return float(value.replace(",", ""))
+    except ValueError:
+        return None
+
+def _find_amount(text: str) -> Tuple[Optional[float], Optional[str], float]:
+    """Return (amount, currency, confidence) from the best labelled amount in the text."""
+    for pattern, confidence in ((STRONG_AMOUNT_RE, 0.45), (WEAK_AMOUNT_RE, 0.25)):
+        matches = list(pattern.finditer(text))
+        amounts = {_parse_amount(m.group(2)) for m in matches} - {None, 0.0}
+        if not amounts:
+            continue
+        match = next(m for m in matches if _parse_amount(m.group(2)) in amounts)
+        if len(amounts) > 1:
+            # Several different labelled totals: likely a statement with sub-totals
+            confidence -= 0.2
+        return _parse_amount(match.group(2)), currency_code(match.group(1) or match.group(3)), confidence
+    return None, None, 0.0
+
+def _find_currency(text: str) -> Optional[str]:
+    match = CURRENCY_RE.search(text)
+    return currency_code(match.group(1)) if match else None
+
+def detect_status(text: str) -> Optional[str]:
+    if PAID_RE.search(text):
+        return "paid"
+    if UNPAID_RE.search(text):
+        return "unpaid"
+    return None
+
+def extract_bill_fields(text: str, sender: str = None) -> Tuple[Dict[str, Any], float]:
+    """
+    Extract vendor, date, due_date, amount, currency, category and status
+    with regex and keyword tables. Returns (bill_data, confidence in [0, 1]).
+    """
+    data = {field: None for field in ["vendor", "date", "due_date", "amount", "currency", "category", "status"]}
+    if not text:
+        return data, 0.0
+    confidence = 0.0
+
+    amount, currency, amount_confidence = _find_amount(text)
+    if amount is not None:
+        data["amount"] = amount
+        confidence += amount_confidence
+    data["currency"] = currency or (_find_currency(text) if amount is not None else None)
+    if data["currency"]:
+        confidence += 0.15 if currency else 0.1
+
+    due_match = DUE_DATE_RE.search(text)
+    if due_match:
+        data["due_date"] = due_match.group(1)
+        confidence += 0.1
+    date_match = DATE_RE.search(text)
+    if date_match:
+        data["date"] = date_match.group(1)
+        confidence += 0.1
+
+    for pattern, vendor, category in KNOWN_VENDOR_RES:
+        if pattern.search(text):
+            data["vendor"] = data["vendor"] or vendor
+            data["category"] = data["category"] or category
+    if not data["vendor"]:
+        vendor_match = VENDOR_RE.search(text)
+        if vendor_match:
+            data["vendor"] = vendor_match.group(1).strip()
+        elif sender:
+            sender_match = SENDER_NAME_RE.match(sender)
+            if sender_match:
+                data["vendor"] = sender_match.group(1).strip()
+    if data["vendor"]:
+        confidence += 0.2
+
+    if not data["category"]:
+        for pattern, category in CATEGORY_RES:
+            if pattern.search(text):
+                data["category"] = category
+                break
+
+    data["status"] = detect_status(text)
+    return data, round(min(confidence, 1.0), 2)
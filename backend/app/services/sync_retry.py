@@ -0,0 +1,97 @@
+from typing import Dict, Iterable, List, Set
+import redis
+from loguru import logger
+from app.config import settings
+from app.redis_client import get_redis
+
+# The Gmail history checkpoint moves past every listed message, so messages
+# whose fetch, extraction, LLM call or save failed are remembered here per
+# user and queued again by the next sync, up to SYNC_MESSAGE_MAX_ATTEMPTS times.
+# Messages the bill classifier skipped are remembered with their score, so
+# full syncs don't triage them again and they can be requeued if it was wrong.
+
+def _key(user_id: int) -> str:
+    return f"sync:retry:{user_id}"
+
+def _skipped_key(user_id: int) -> str:
+    return f"sync:skipped:{user_id}"
+
+def pending(user_id: int) -> List[str]:
+    """Message IDs to queue again this sync; messages out of attempts are given up on."""
+    try:
+        attempts = get_redis().hgetall(_key(user_id))
+    except redis.RedisError as e:
+        logger.warning(f"Could not read messages to retry for user {user_id}: {str(e)}")
+        return []
+    retry, exhausted = [], []
+    for msg_id, count in attempts.items():
+        msg_id = msg_id.decode("utf-8")
+        (retry if int(count) < settings.SYNC_MESSAGE_MAX_ATTEMPTS else exhausted).append(msg_id)
+    if exhausted:
+        logger.warning(f"Giving up on {len(exhausted)} messages for user {user_id} after {settings.SYNC_MESSAGE_MAX_ATTEMPTS} attempts: {exhausted}")
+        forget(user_id, exhausted)
+    if retry:
+        logger.info(f"Retrying {len(retry)} messages that failed in earlier syncs for user {user_id}")
+    return retry
+
+def remember(user_id: int, message_ids: Iterable[str]) -> bool:
+    """Count an unfinished attempt for each message; False when they could not be recorded."""
+    message_ids = list(message_ids)
+    if not message_ids:
+        return True
+    try:
+        pipe = get_redis().pipeline()
+        for msg_id in message_ids:
+            pipe.hincrby(_key(user_id), msg_id, 1)
+        pipe.execute()
+        return True
+    except redis.RedisError as e:
+        logger.error(f"Could not record {len(message_ids)} messages to retry for user {user_id}: {str(e)}")
+        return False
+
+def forget(user_id: int, message_ids: Iterable[str]):
+    """Mark messages as done so later syncs don't retry them."""
+    message_ids = list(message_ids)
+    if not message_ids:
+        return
+    try:
+        get_redis().hdel(_key(user_id), *message_ids)
+    except redis.RedisError as e:
+        # They'll be processed once more by the next sync, which is harmless
+        logger.warning(f"Could not clear retried messages for user {user_id}: {str(e)}")
+
+def remember_skipped(user_id: int, scores: Dict[str, float]):
+    """Record messages the bill classifier skipped, with their scores."""
+    if not scores:
+        return
+    try:
+        get_redis().hset(_skipped_key(user_id), mapping={msg_id: f"{score:.3f}" for msg_id, score in scores.items()})
+    except redis.RedisError as e:
+        # Only costs a second triage of these messages on the next full sync
+        logger.warning(f"Could not record {len(scores)} skipped messages for user {user_id}: {str(e)}")
+
+def skipped(user_id: int, message_ids: List[str]) -> Set[str]:
+    """The IDs among message_ids that the bill classifier skipped before."""
+    if not message_ids:
+        return set()
+    try:
+        scores = get_redis().hmget(_skipped_key(user_id), message_ids)
+    except redis.RedisError as e:
+        logger.warning(f"Could not read skipped messages for user {user_id}: {str(e)}")
+        return set()
+    return {msg_id for msg_id, score in zip(message_ids, scores) if score is not None}
+
+def requeue_skipped(user_id: int) -> int:
+    """Move every skipped message into the retry set, so the next sync fetches it without triage."""
+    try:
+        r = get_redis()
+        message_ids = [msg_id.decode("utf-8") for msg_id in r.hkeys(_skipped_key(user_id))]
+        if message_ids:
+            pipe = r.pipeline()
+            pipe.hset(_key(user_id), mapping={msg_id: 0 for msg_id in message_ids})
+            pipe.delete(_skipped_key(user_id))
+            pipe.execute()
+    except redis.RedisError as e:
+        logger.error(f"Could not requeue skipped messages for user {user_id}: {str(e)}")
+        return 0
+    return len(message_ids)
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import re
+import threading
+import time
+import traceback
+from email.utils import parseaddr
+from typing import Any, Dict, List, Optional
+from loguru import logger
+from sqlalchemy.exc import IntegrityError
+from app import models
+from app.config import settings
+from app.database import SessionLocal
+from app.services.rule_extractor import (
+    NUMBER_PATTERN, CURRENCY_PATTERN, DATE_VALUE_PATTERN, currency_code, detect_status,
+)
+
+# Recurring senders (electricity, water, arnona, telecom) send the same layout
+# every month. Once extractions of a layout agree on the label in front of each
+# field, later messages are read straight off those labels without the LLM.
+
+KNOWN_SENDERS_TTL = 300
+
+MAX_LABEL_CHARS = 40
+FINGERPRINT_LINES = 15
+
+_SEPARATORS = " \t:-–|"
+_LETTER_RE = re.compile(r"[^\W\d_]")
+_VALUE_PATTERNS = {
+    "amount": r"(?:" + CURRENCY_PATTERN + r"\s*)?" + NUMBER_PATTERN + r"(?:\s*" + CURRENCY_PATTERN + r")?",
+    "date": DATE_VALUE_PATTERN,
+    "due_date": DATE_VALUE_PATTERN,
+}
+
+def sender_address(from_header: Optional[str]) -> Optional[str]:
+    address = parseaddr(from_header or "")[1].strip().lower()
+    return address or None
+
+def layout_fingerprint(text: str) -> str:
+    """Hash of the first label-like lines with digits masked, so monthly values don't change it."""
+    lines = []
+    for line in text.splitlines():
+        line = re.sub(r"\s+", " ", re.sub(r"\d[\d,.]*", "9", line)).strip()
+        if line and len(line) <= 60 and _LETTER_RE.search(line):
+            lines.append(line.lower())
+            if len(lines) == FINGERPRINT_LINES:
+                break
+    return hashlib.sha1("\n".join(lines).encode("utf-8")).hexdigest()[:32]
+
+def _amount_forms(amount: float) -> List[str]:
+    forms = [f"{amount:,.2f}", f"{amount:.2f}"]
+    if amount == int(amount):
+        forms += [f"{int(amount):,}", str(int(amount))]
+    else:
+        forms += [f"{amount:,.1f}", f"{amount:.1f}"]
+    return list(dict.fromkeys(forms))
+
+def _clean_label(prefix: str) -> str:
+    prefix = re.sub(CURRENCY_PATTERN + r"\s*$", "", prefix.rstrip(_SEPARATORS)).rstrip(_SEPARATORS)
+    return prefix[-MAX_LABEL_CHARS:].lstrip(_SEPARATORS)
+
+def _find_anchor(text: str, values: List[str]) -> Optional[Dict[str, Any]]:
+    """The label in front of the first occurrence of any of values: same line, else the line above."""
+    lines = text.splitlines()
+    for index, line in enumerate(lines):
+        for value in values:
+            match = re.search(r"(?<![\d.,])" + re.escape(value) + r"(?!\d)", line)
+            if not match:
+                continue
+            label = _clean_label(line[:match.start()])
+            if _LETTER_RE.search(label):
+                return {"label": label, "next_line": False}
+            if label:
+                continue
+            # Table layouts put the label on its own line above the value
+            previous = next((l.strip() for l in reversed(lines[:index]) if l.strip()), "")
+            label = _clean_label(previous)
+            if _LETTER_RE.search(label) and not re.search(r"\d", label):
+                return {"label": label, "next_line": True}
+    return None
+
+def learn_anchors(text: str, bill_data: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    anchors = {}
+    if bill_data.get("amount"):
+        anchor = _find_anchor(text, _amount_forms(float(bill_data["amount"])))
+        if anchor:
+            anchors["amount"] = anchor
+    for field in ["date", "due_date"]:
+        if bill_data.get(field):
+            anchor = _find_anchor(text, [str(bill_data[field])])
+            if anchor:
+                anchors[field] = anchor
+    return anchors
+
+def _read_field(text: str, field: str, anchor: Dict[str, Any]):
+    gap = r"[^\n]*\n\s*" if anchor["next_line"] else r"\s*[:\-–|]?\s*"
+    return re.search(re.escape(anchor["label"]) + gap + _VALUE_PATTERNS[field], text, re.IGNORECASE)
+
+def apply_template(template: models.ExtractionTemplate, text: str) -> Optional[Dict[str, Any]]:
+    """Read the bill fields at the template's anchors; None unless every anchored field is found."""
+    anchors = json.loads(template.anchors)
+    if "amount" not in anchors:
+        return None
+    bill = {
+        "vendor": template.vendor, "date": None, "due_date": None, "amount": None,
+        "currency": template.currency, "category": template.category, "status": detect_status(text),
+    }
+    for field, anchor in anchors.items():
+        match = _read_field(text, field, anchor)
+        if not match:
+            return None
+        if field == "amount":
+            try:
+                amount = float(match.group(2).replace(",", ""))
+            except ValueError:
+                return None
+            if amount <= 0:
+                return None
+            bill["amount"] = amount
+            bill["currency"] = currency_code(match.group(1) or match.group(3)) or template.currency
+        else:
+            bill[field] = match.group(1)
+    return bill
+
+class UserTemplates:
+    """
+    One user's established templates, loaded once per sync so matching a
+    message doesn't touch the database. Hits and failures are counted in
+    memory and written back together by flush().
+    """
+
+    def __init__(self, user_id: int, templates: List[models.ExtractionTemplate] = ()):
+        self.user_id = user_id
+        self._templates = {(template.sender, template.fingerprint): template for template in templates}
+        self.senders = frozenset(sender for sender, _ in self._templates)
+        self._counts = {}  # template id -> [hits, failures]
+        self._lock = threading.Lock()
+
+    def match(self, from_header: Optional[str], text: str) -> Optional[Dict[str, Any]]:
+        """Extract a bill with the sender's learned template, or None to fall back to the LLM."""
+        sender = sender_address(from_header)
+        if not sender or not text:
+            return None
+        key = (sender, layout_fingerprint(text))
+        template = self._templates.get(key)
+        if template is None:
+            return None
+        try:
+            bill = apply_template(template, text)
+        except Exception as e:
+            logger.error(f"Template matching failed for {sender}: {str(e)}")
+            logger.error(traceback.format_exc())
+            return None
+        with self._lock:
+            counts = self._counts.setdefault(template.id, [0, 0])
+            if bill is not None:
+                counts[0] += 1
+                return bill
+            counts[1] += 1
+            failures, hits = template.failures + counts[1], template.hits + counts[0]
+            if failures >= settings.TEMPLATE_MAX_FAILURES and failures > hits:
+                # flush() deletes it; stop using it for the rest of this sync
+                self._templates.pop(key, None)
+        return None
+
+    def flush(self):
+        """Add this sync's hits and failures to the templates and drop the ones that keep failing."""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return
+        Template = models.ExtractionTemplate
+        db = SessionLocal()
+        try:
+            for template_id, (hits, failures) in counts.items():
+                db.query(Template).filter(Template.id == template_id).update(
+                    {Template.hits: Template.hits + hits, Template.failures: Template.failures + failures},
+                    synchronize_session=False,
+                )
+            dropped = db.query(Template).filter(
+                Template.id.in_(list(counts)),
+                Template.failures >= settings.TEMPLATE_MAX_FAILURES,
+                Template.failures > Template.hits,
+            ).delete(synchronize_session=False)
+            db.commit()
+            if dropped:
+                logger.info(f"Dropped {dropped} extraction templates of user {self.user_id} that kept failing")
+        except Exception as e:
+            logger.error(f"Failed to save extraction template counts for user {self.user_id}: {str(e)}")
+            db.rollback()
+        finally:
+            db.close()
+
+def load_templates(user_id: int) -> UserTemplates:
+    """The user's templates with enough agreeing samples to be used."""
+    db = SessionLocal()
+    try:
+        return UserTemplates(user_id, db.query(models.ExtractionTemplate).filter(
+            models.ExtractionTemplate.user_id == user_id,
+            models.ExtractionTemplate.samples >= settings.TEMPLATE_MIN_SAMPLES,
+        ).all())
+    except Exception as e:
+        logger.error(f"Failed to load extraction templates for user {user_id}: {str(e)}")
+        return UserTemplates(user_id)
+    finally:
+        db.close()
+
+_known_senders = {}  # user_id -> (loaded_at, senders)
+
+def known_senders(user_id: int) -> frozenset:
+    """Addresses with an established template for the user, refreshed every few minutes."""
+    loaded_at, senders = _known_senders.get(user_id, (0.0, frozenset()))
+    if time.monotonic() - loaded_at < KNOWN_SENDERS_TTL:
+        return senders
+    db = SessionLocal()
+    try:
+        senders = frozenset(
+            row[0] for row in db.query(models.ExtractionTemplate.sender).filter(
+                models.ExtractionTemplate.user_id == user_id,
+                models.ExtractionTemplate.samples >= settings.TEMPLATE_MIN_SAMPLES,
+            ).distinct()
+        )
+    except Exception as e:
+        logger.error(f"Failed to load known bill senders for user {user_id}: {str(e)}")
+    finally:
+        db.close()
+    _known_senders[user_id] = (time.monotonic(), senders)
+    return senders
+
+def learn_batch(user_id: int, batch_texts: List[str], bill_data_batch: List[Dict[str, Any]], batch_metadata: List[Dict[str, Any]]):
+    """Record or confirm templates from extracted bills of whole (unsplit) messages."""
+    db = SessionLocal()
+    try:
+        for text, bill_data, metadata in zip(batch_texts, bill_data_batch, batch_metadata):
+            sender = sender_address(metadata.get("sender"))
+            if not sender or not bill_data or metadata.get("parts", 1) > 1:
+                continue
+            anchors = learn_anchors(text, bill_data)
+            if "amount" not in anchors:
+                continue
+            _record(db, user_id, sender, layout_fingerprint(text), anchors, bill_data)
+    finally:
+        db.close()
+
+def _record(db, user_id: int, sender: str, fingerprint: str, anchors: Dict[str, Any], bill_data: Dict[str, Any]):
+    anchors_json = json.dumps(anchors, ensure_ascii=False, sort_keys=True)
+    try:
+        template = db.query(models.ExtractionTemplate).filter(
+            models.ExtractionTemplate.user_id == user_id,
+            models.ExtractionTemplate.sender == sender,
+            models.ExtractionTemplate.fingerprint == fingerprint,
+        ).first()
+        if template is None:
+            db.add(models.ExtractionTemplate(
+                user_id=user_id, sender=sender, fingerprint=fingerprint, anchors=anchors_json, vendor=bill_data.get("vendor"),
+                category=bill_data.get("category"), currency=bill_data.get("currency"), samples=1, hits=0, failures=0,
+            ))
+        elif template.anchors == anchors_json:
+            template.samples += 1
+        else:
+            # The layout moved its labels; start counting agreement again
+            template.anchors = anchors_json
+            template.samples = 1
+            template.failures = 0
+            template.vendor = bill_data.get("vendor") or template.vendor
+            template.category = bill_data.get("category") or template.category
+            template.currency = bill_data.get("currency") or template.currency
+        db.commit()
+    except IntegrityError:
+        # Another worker learned the same layout concurrently
+        db.rollback()
+    except Exception as e:
+        logger.error(f"Failed to record extraction template for {sender}: {str(e)}")
+        db.rollback()
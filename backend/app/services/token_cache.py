@@ -0,0 +1,60 @@
+import hashlib
+import redis
+from loguru import logger
+from app.config import settings
+from app.redis_client import get_redis
+from app.services import gmail_service
+
+def _cache_key(user_id: int, refresh_token: str) -> str:
+    # Include a fingerprint of the refresh token so a re-consent invalidates the cached access token
+    fingerprint = hashlib.sha256(refresh_token.encode("utf-8")).hexdigest()[:16]
+    return f"gmail:access_token:{user_id}:{fingerprint}"
+
+def get_access_token(user_id: int, refresh_token: str) -> str:
+    """
+    Return a valid Gmail access token for the user, refreshing it only when the
+    cached one is missing or about to expire. A per-user Redis lock makes sure
+    concurrent tasks trigger a single refresh and reuse its result.
+    """
+    key = _cache_key(user_id, refresh_token)
+    try:
+        r = get_redis()
+        cached = r.get(key)
+        if cached:
+            logger.debug(f"Using cached access token for user ID {user_id}")
+            return cached.decode("utf-8")
+        lock = r.lock(f"{key}:lock", timeout=30, blocking_timeout=settings.ACCESS_TOKEN_LOCK_WAIT)
+        acquired = lock.acquire()
+    except redis.RedisError as e:
+        logger.warning(f"Access token cache unavailable, refreshing directly: {str(e)}")
+        return gmail_service.refresh_access_token(refresh_token)
+
+    try:
+        if acquired:
+            # Another task may have refreshed the token while we waited for the lock
+            try:
+                cached = r.get(key)
+            except redis.RedisError as e:
+                logger.warning(f"Access token cache unavailable, refreshing directly: {str(e)}")
+                cached = None
+            if cached:
+                return cached.decode("utf-8")
+        else:
+            logger.warning(f"Timed out waiting for token refresh lock for user ID {user_id}")
+
+        token_info = gmail_service.refresh_access_token_info(refresh_token)
+        access_token = token_info["access_token"]
+        ttl = int(token_info.get("expires_in", 3600)) - settings.ACCESS_TOKEN_TTL_MARGIN
+        if ttl > 0:
+            try:
+                r.set(key, access_token, ex=ttl)
+            except redis.RedisError as e:
+                # The token is valid regardless; the next task just refreshes again
+                logger.warning(f"Failed to cache access token for user ID {user_id}: {str(e)}")
+        return access_token
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except redis.RedisError as e:
+                logger.warning(f"Failed to release token refresh lock: {str(e)}")
@@ -0,0 +1,50 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+from app.config import settings
+
+@dataclass(frozen=True)
+class CachedUser:
+    """The fields API handlers read from the authenticated user; never the refresh token."""
+    id: int
+    email: str
+    name: Optional[str] = None
+
+class UserCache:
+    """
+    Per-process TTL + LRU cache of users by ID, so JWT-authenticated requests
+    skip the database. Entries expire after USER_CACHE_TTL seconds, which also
+    bounds how long another process's update can go unseen here.
+    """
+
+    def __init__(self, max_size: int = None, ttl: float = None):
+        self.max_size = max_size or settings.USER_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else settings.USER_CACHE_TTL
+        self._entries = OrderedDict()  # user_id -> (expires_at, CachedUser)
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Optional[CachedUser]:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return entry[1]
+
+    def put(self, user: CachedUser):
+        with self._lock:
+            self._entries[user.id] = (time.monotonic() + self.ttl, user)
+            self._entries.move_to_end(user.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+user_cache = UserCache()
@@ -1,31 +1,83 @@
-from fastapi import APIRouter, Depends
-from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from datetime import datetime, date
+import asyncio
 import traceback
 from app.auth import get_current_user
-from app.database import SessionLocal
+from app.services.user_cache import CachedUser
+from app.config import settings
+from app.database import SessionLocal, get_db
 from app import models, schemas
-from app.services import gmail_service, pdf_service, image_service, html_service, openai_service, storage_service
+from app.services import gmail_service, openai_service, storage_service, token_cache, extraction_cache, template_store, bill_query, bill_summary, bill_backfill, sync_retry
+from app.pipeline import SyncPipeline, BatchPacker, ResultAssembler, SYNC_QUERY, fetch_message_text, filter_new_message_ids, message_metadata, save_bills
 from app.celery_app import celery_app
+from celery import chord, group
 from loguru import logger
-from typing import List, Dict, Any
-from app.services.openai_service import extract_bills_data_from_batch, estimate_token_count
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Dict, Any, Literal, Optional
+from app.services.openai_service import extract_bills_data_from_batch
 
 router = APIRouter()
 
 @router.post("/sync")
-def sync_gmail_background(current_user: models.User = Depends(get_current_user)):
+def sync_gmail_background(current_user: CachedUser = Depends(get_current_user)):
     celery_app.send_task("app.tasks.sync_gmail_inbox", args=[current_user.id])
     return {"message": "Gmail sync initiated"}
 
 @router.get("/bills", response_model=list[schemas.BillOut])
-def list_bills(current_user: models.User = Depends(get_current_user)):
-    db = SessionLocal()
-    bills = db.query(models.Bill).filter(models.Bill.user_id == current_user.id).all()
-    db.close()
+async def list_bills(
+    response: Response,
+    vendor: Optional[str] = None,
+    category: Optional[str] = None,
+    paid: Optional[bool] = None,
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    due_from: Optional[date] = None,
+    due_to: Optional[date] = None,
+    currency: Optional[str] = None,
+    amount_min: Optional[float] = None,
+    amount_max: Optional[float] = None,
+    sort: Literal["date", "due_date", "amount", "id"] = "date",
+    order: Literal["asc", "desc"] = "desc",
+    limit: int = Query(settings.BILLS_PAGE_SIZE, ge=1, le=settings.BILLS_MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """One page of the user's bills; the cursor for the next page is sent in the X-Next-Cursor header."""
+    statement = bill_query.filter_bills(
+        select(models.Bill).where(models.Bill.user_id == current_user.id),
+        vendor=vendor, category=category, paid=paid, date_from=date_from, date_to=date_to,
+        due_from=due_from, due_to=due_to, currency=currency, amount_min=amount_min, amount_max=amount_max,
+    )
+    try:
+        bills, next_cursor = await bill_query.paginate(db, statement, sort, order == "desc", limit, cursor)
+    except bill_query.InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return bills
 
+@router.get("/bills/summary", response_model=list[schemas.BillSummaryOut])
+async def bills_summary(current_user: CachedUser = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Totals by month, category, currency and paid flag, read from the maintained summary table."""
+    result = await db.execute(
+        select(models.BillSummary).where(
+            models.BillSummary.user_id == current_user.id,
+            models.BillSummary.count > 0,
+        ).order_by(models.BillSummary.month, models.BillSummary.category)
+    )
+    groups = result.scalars().all()
+    return [
+        schemas.BillSummaryOut(
+            month=group.month or None, category=group.category or None, currency=group.currency or None,
+            paid=group.paid, total=float(group.total), count=group.count,
+        )
+        for group in groups
+    ]
+
 @router.get("/user/me")
-def get_current_user_info(current_user: models.User = Depends(get_current_user)):
+async def get_current_user_info(current_user: CachedUser = Depends(get_current_user)):
     return {
         "id": current_user.id,
         "email": current_user.email,
@@ -49,8 +101,8 @@ def sync_gmail_inbox(user_id: int):
         return "No refresh token available"
     
     try:
-        logger.info(f"Refreshing access token for {user.email}")
-        access_token = gmail_service.refresh_access_token(user.google_refresh_token)
+        logger.info(f"Getting access token for {user.email}")
+        access_token = token_cache.get_access_token(user.id, user.google_refresh_token)
         logger.info(f"Successfully obtained access token")
     except Exception as e:
         logger.error(f"Token refresh failed for {user.email}: {str(e)}")
@@ -58,153 +110,274 @@ def sync_gmail_inbox(user_id: int):
         db.close()
         return f"Token refresh failed: {str(e)}"
     
-    query = 'has:attachment OR subject:(bill OR invoice OR חשבונית OR קבלה)'
+    incremental = False
     try:
-        logger.info(f"Fetching messages with query: {query}")
-        # Enhanced query with more Hebrew bill-related terms
-        query = 'has:attachment OR subject:(bill OR invoice OR receipt OR payment OR חשבונית OR קבלה OR חשבון OR ארנונה OR מים OR גז OR חשמל OR לתשלום OR תשלום OR תשלומים OR חיוב OR tax)'
-        message_ids = gmail_service.list_message_ids(access_token, query=query, max_results=50)
-        if not message_ids:
-            logger.info(f"No messages found for {user.email}")
-            db.close()
-            return "No messages found"
-        logger.info(f"Found {len(message_ids)} messages")
+        if user.gmail_history_id:
+            try:
+                history_ids, new_history_id = gmail_service.list_history_message_ids(access_token, user.gmail_history_id)
+                incremental = True
+            except gmail_service.HistoryExpiredError as e:
+                logger.warning(f"{e}; falling back to a full query for {user.email}")
+        if not incremental:
+            # Take the checkpoint before listing so mail arriving mid-sync is picked up next time
+            new_history_id = gmail_service.get_profile(access_token).get("historyId")
     except Exception as e:
         error_msg = f"Gmail API error for {user.email}: {str(e)}"
         logger.error(error_msg)
         logger.error(traceback.format_exc())
         db.close()
         return f"Gmail API error: {str(e)}"
-    
-    # First, filter out already processed messages
-    existing_message_ids = {
-        result[0] for result in 
-        db.query(models.Bill.message_id).filter(
-            models.Bill.user_id==user.id, 
-            models.Bill.message_id.in_(message_ids)
-        ).all()
-    }
-    
-    new_message_ids = [msg_id for msg_id in message_ids if msg_id not in existing_message_ids]
-    logger.info(f"Found {len(new_message_ids)} new messages to process")
-    
-    if not new_message_ids:
+
+    page_size = settings.GMAIL_SYNC_PAGE_SIZE
+    if incremental:
+        pages = (history_ids[i:i + page_size] for i in range(0, len(history_ids), page_size))
+    else:
+        logger.info(f"Fetching messages with query: {SYNC_QUERY}")
+        pages = gmail_service.iter_message_id_pages(
+            access_token, query=SYNC_QUERY, page_size=page_size, max_results=settings.GMAIL_SYNC_MAX_MESSAGES
+        )
+
+    retry_ids = sync_retry.pending(user.id)
+    if settings.SYNC_MODE == "fanout":
+        return dispatch_sync_fanout(user, db, access_token, pages, incremental, new_history_id, retry_ids)
+
+    try:
+        pipeline = asyncio.run(SyncPipeline(access_token, user.id, db, pages, incremental=incremental, retry_ids=retry_ids).run())
+    except Exception as e:
+        # The checkpoint stays put, so the next sync lists these messages again. Count
+        # the attempt for retried ones so a message that keeps breaking the sync is dropped.
+        logger.error(f"Sync pipeline failed for {user.email}: {str(e)}")
+        logger.error(traceback.format_exc())
+        sync_retry.remember(user.id, retry_ids)
         db.close()
-        return "No new messages to process"
-    
-    batch_texts = []
-    batch_metadata = []
-    current_batch_tokens = 0
-    max_tokens_per_batch = 6000  # Safe threshold under 8000 tokens/minute limit
-
-    for msg_id in new_message_ids:
-        try:
-            message = gmail_service.get_message(access_token, msg_id)
-            full_text_segments = []
-            
-            # Extract message body
-            payload = message.get("payload", {})
-            if payload.get("body", {}).get("data"):
-                import base64
-                body_text = base64.urlsafe_b64decode(payload["body"]["data"] + "==").decode("utf-8", errors="ignore")
-                full_text_segments.append(body_text)
-                urls = gmail_service.extract_urls_from_text(body_text)
-            else:
-                urls = []
-            
-            # Process attachments
-            attachments = gmail_service.get_attachments_info(message)
-            for attach in attachments:
-                att_id = attach["attachmentId"]
-                filename = attach["filename"]
-                mime = attach["mimeType"]
-                try:
-                    data = gmail_service.download_attachment(access_token, msg_id, att_id)
-                except Exception as e:
-                    logger.error(f"Attachment download failed for {filename}: {str(e)}")
-                    continue
-                
-                if filename.lower().endswith(".pdf") or mime == "application/pdf":
-                    pdf_text = pdf_service.extract_text_from_pdf(data)
-                    if pdf_text:
-                        full_text_segments.append(pdf_text)
-                elif mime in ["image/jpeg", "image/png"]:
-                    ocr_text = image_service.extract_text_from_image(data)
-                    if ocr_text:
-                        full_text_segments.append(ocr_text)
-            
-            # Process URLs in the email
-            for url in urls:
-                try:
-                    import requests
-                    resp = requests.get(url, timeout=10)
-                    content_type = resp.headers.get("Content-Type", "")
-                    if "application/pdf" in content_type or url.lower().endswith(".pdf"):
-                        pdf_text = pdf_service.extract_text_from_pdf(resp.content)
-                        if pdf_text:
-                            full_text_segments.append(pdf_text)
-                    elif "text/html" in content_type:
-                        html_text = html_service.extract_text_from_html(resp.text)
-                        if html_text:
-                            full_text_segments.append(html_text)
-                except Exception as e:
-                    logger.error(f"Failed to fetch URL {url}: {str(e)}")
-                    continue
-            
-            if full_text_segments:
-                combined_text = "\n".join(full_text_segments)
-                email_tokens = estimate_token_count(combined_text)
-
-                if current_batch_tokens + email_tokens > max_tokens_per_batch and batch_texts:
-                    # Process current batch
-                    process_batch(batch_texts, batch_metadata, user, db)
-                    batch_texts, batch_metadata, current_batch_tokens = [], [], 0
-
-                batch_texts.append(combined_text)
-                batch_metadata.append({"message_id": msg_id, "paid": detect_paid_status(combined_text)})
-                current_batch_tokens += email_tokens
-
-        except Exception as e:
-            logger.error(f"Error processing message {msg_id}: {str(e)}")
-            logger.error(traceback.format_exc())
-
-    # Process any remaining batch
-    if batch_texts:
-        process_batch(batch_texts, batch_metadata, user, db)
+        return f"Sync pipeline error: {str(e)}"
+    logger.info(
+        f"Sync for {user.email} listed {pipeline.listed_count} messages, "
+        f"{pipeline.new_count} new, {pipeline.saved_count} bills saved, {len(pipeline.failed_ids)} failed"
+    )
+    logger.info(f"Extraction cache stats: {extraction_cache.get_stats()}")
+    sync_retry.forget(user.id, [msg_id for msg_id in retry_ids if msg_id not in pipeline.failed_ids])
+    failures_recorded = sync_retry.remember(user.id, pipeline.failed_ids)
+    if pipeline.listing_error:
+        # Listing stopped part way: keep what was extracted but leave the checkpoint alone
+        db.close()
+        return f"Gmail API error: {str(pipeline.listing_error)}"
+    if not failures_recorded:
+        # The failed messages can only be found again by listing from the old checkpoint
+        db.close()
+        return f"Sync completed with {len(pipeline.failed_ids)} failed messages"
 
+    save_history_checkpoint(user, new_history_id, db)
     db.close()
+    if not pipeline.listed_count:
+        return "No messages found"
+    if not pipeline.new_count:
+        return "No new messages to process"
     return "Sync completed"
 
-def process_batch(batch_texts, batch_metadata, user, db):
+def save_history_checkpoint(user, history_id, db):
+    if not history_id:
+        return
     try:
-        logger.info(f"Sending batch of {len(batch_texts)} emails to OpenAI for analysis")
-        bill_data_batch = extract_bills_data_from_batch(batch_texts)
+        user.gmail_history_id = str(history_id)
+        db.commit()
+        logger.info(f"Saved Gmail history checkpoint {history_id} for {user.email}")
+    except Exception as e:
+        logger.error(f"Failed to save history checkpoint for {user.email}: {str(e)}")
+        db.rollback()
+
+def dispatch_sync_fanout(user, db, access_token, pages, incremental, new_history_id, retry_ids=()):
+    """
+    Coordinator side of the fan-out mode: list new message IDs and hand each
+    chunk to a chord of per-message extraction tasks whose callback batches
+    the texts for the LLM and persists the bills. Dispatched messages are
+    remembered for retry until their subtasks report them done, since the
+    checkpoint is saved before they run.
+    """
+    listed_count = 0
+    new_count = 0
+    chunk_size = settings.SYNC_FANOUT_CHUNK_SIZE
+    retry_set = set(retry_ids)
+    recorded = True
+
+    def dispatch(message_ids, triage=True):
+        nonlocal recorded
+        for i in range(0, len(message_ids), chunk_size):
+            chunk = message_ids[i:i + chunk_size]
+            recorded = sync_retry.remember(user.id, chunk) and recorded
+            header = group(extract_message_text.s(user.id, msg_id, incremental, triage) for msg_id in chunk)
+            chord(header)(persist_extracted_messages.s(user.id))
+
+    try:
+        dispatch(list(retry_ids), triage=False)
+        for message_ids in pages:
+            listed_count += len(message_ids)
+            message_ids = [msg_id for msg_id in message_ids if msg_id not in retry_set]
+            new_message_ids = message_ids if incremental else filter_new_message_ids(message_ids, user.id, db)
+            new_count += len(new_message_ids)
+            dispatch(new_message_ids)
+    except Exception as e:
+        # Listing stopped part way: chunks already dispatched still run, but keep the old checkpoint
+        logger.error(f"Gmail API error for {user.email}: {str(e)}")
+        logger.error(traceback.format_exc())
+        db.close()
+        return f"Gmail API error: {str(e)}"
 
-        for bill_data, metadata in zip(bill_data_batch, batch_metadata):
+    logger.info(f"Sync for {user.email} listed {listed_count} messages, dispatched {new_count} for extraction")
+    if recorded:
+        save_history_checkpoint(user, new_history_id, db)
+    else:
+        logger.warning(f"Keeping the old history checkpoint for {user.email}: dispatched messages could not be recorded for retry")
+    db.close()
+    if not listed_count:
+        return "No messages found"
+    if not new_count:
+        return "No new messages to process"
+    return f"Dispatched {new_count} messages"
+
+@celery_app.task(name="app.tasks.extract_message_text")
+def extract_message_text(user_id: int, msg_id: str, incremental: bool = False, triage: bool = True):
+    """Fetch one message and return its extracted text; failures return None so the chord still completes."""
+    db = SessionLocal()
+    try:
+        user = db.query(models.User).get(user_id)
+        refresh_token = user.google_refresh_token if user else None
+    finally:
+        db.close()
+    if not refresh_token:
+        logger.error(f"User ID {user_id} not found or has no refresh token")
+        return None
+
+    try:
+        access_token = token_cache.get_access_token(user_id, refresh_token)
+        combined_text, sender = fetch_message_text(access_token, msg_id, user_id, incremental=incremental, triage=triage)
+    except Exception as e:
+        logger.error(f"Error processing message {msg_id}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return None
+    if not combined_text:
+        # Nothing to extract a bill from, which is a finished message too
+        sync_retry.forget(user_id, [msg_id])
+        return None
+    return {"message_id": msg_id, "text": combined_text, "sender": sender}
+
+@celery_app.task(name="app.tasks.persist_extracted_messages")
+def persist_extracted_messages(results: List[Dict[str, Any]], user_id: int):
+    """Chord callback: pack the extracted texts into LLM batches and save the bills."""
+    packer = BatchPacker()
+    batches = []
+    template_bills, template_metadata = [], []
+    templates = template_store.load_templates(user_id)
+    for result in results:
+        if not result:
+            continue
+        template_bill = templates.match(result.get("sender"), result["text"])
+        if template_bill:
+            template_bills.append(template_bill)
+            template_metadata.append(message_metadata(result["message_id"], result["text"], result.get("sender")))
+        else:
+            batches.extend(packer.add(result["message_id"], result["text"], result.get("sender")))
+    batches.extend(packer.flush())
+    templates.flush()
+
+    db = SessionLocal()
+    failed = set()
+    try:
+        if template_bills:
+            logger.info(f"Extracted {len(template_bills)} messages with sender templates")
             try:
-                bill = models.Bill(
-                    user_id=user.id,
-                    message_id=metadata["message_id"],
-                    vendor=bill_data.get("vendor"),
-                    date=bill_data.get("date"),
-                    due_date=bill_data.get("due_date"),
-                    amount=bill_data.get("amount"),
-                    currency=bill_data.get("currency"),
-                    category=bill_data.get("category"),
-                    status=bill_data.get("status"),
-                    blob_name="",
-                    paid=metadata["paid"]
-                )
-                db.add(bill)
-                db.commit()
+                save_bills(template_bills, template_metadata, user_id, db, failed)
             except Exception as e:
-                logger.error(f"Error saving bill to database: {str(e)}")
-                db.rollback()
+                logger.error(f"Saving template-extracted bills failed: {str(e)}")
+                failed.update(metadata["message_id"] for metadata in template_metadata)
+        assembler = ResultAssembler()
+        for batch_texts, batch_metadata in batches:
+            process_batch(batch_texts, batch_metadata, user_id, db, assembler, failed)
+    finally:
+        db.close()
+    # Messages whose extraction subtask failed returned None and stay recorded for retry
+    sync_retry.forget(user_id, [
+        result["message_id"] for result in results if result and result["message_id"] not in failed
+    ])
+    return f"Processed {len(template_bills) + sum(len(set(m['message_id'] for m in metadata)) for _, metadata in batches)} messages"
 
+def process_batch(batch_texts, batch_metadata, user_id, db, assembler=None, failed: set = None):
+    try:
+        logger.info(f"Sending batch of {len(batch_texts)} emails to OpenAI for analysis")
+        bill_data_batch = extract_bills_data_from_batch(batch_texts, [metadata.get("sender") for metadata in batch_metadata])
+        template_store.learn_batch(user_id, batch_texts, bill_data_batch, batch_metadata)
+        if assembler is not None:
+            bill_data_batch, batch_metadata = assembler.add(bill_data_batch, batch_metadata)
+        save_bills(bill_data_batch, batch_metadata, user_id, db, failed)
     except Exception as e:
         logger.error(f"Batch processing failed: {str(e)}")
         logger.error(traceback.format_exc())
+        if failed is not None:
+            failed.update(metadata["message_id"] for metadata in batch_metadata)
+
+@celery_app.task(name="app.tasks.requeue_skipped_messages")
+def requeue_skipped_messages(user_id: int):
+    """
+    Hand every message the bill classifier skipped for the user to the next
+    sync, which fetches them in full without triage (e.g. after a missed bill
+    is reported or the classifier weights change).
+    """
+    count = sync_retry.requeue_skipped(user_id)
+    logger.info(f"Requeued {count} skipped messages for user ID {user_id}")
+    return count
+
+@celery_app.task(name="app.tasks.rebuild_bill_summaries")
+def rebuild_bill_summaries(user_id: int = None):
+    """Recompute bill summaries from the bills table for one user, or for everyone."""
+    db = SessionLocal()
+    try:
+        user_ids = [user_id] if user_id is not None else bill_summary.user_ids_with_bills(db)
+        for uid in user_ids:
+            bill_summary.rebuild(db, uid)
+            db.commit()
+        logger.info(f"Rebuilt bill summaries for {len(user_ids)} users")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Rebuilding bill summaries failed: {str(e)}")
+        logger.error(traceback.format_exc())
+    finally:
+        db.close()
+
+@celery_app.task(name="app.tasks.backfill_bill_columns")
+def backfill_bill_columns(after_id: int = None):
+    """
+    Fill the typed date and currency columns of existing bills in chunks.
+    Resumes from the Redis checkpoint when after_id is not given, re-queues
+    itself every BACKFILL_CHUNKS_PER_TASK chunks and rebuilds the bill
+    summaries (which group by currency_code and month) when done. Queued once
+    by API startup; re-run by hand with
+    `celery -A app.celery_app call app.tasks.backfill_bill_columns --args='[0]'`.
+    """
+    if after_id is None:
+        after_id = bill_backfill.load_checkpoint()
+    db = SessionLocal()
+    updated = 0
+    try:
+        for _ in range(settings.BACKFILL_CHUNKS_PER_TASK):
+            last_id, chunk_updated = bill_backfill.backfill_chunk(db, after_id, settings.BACKFILL_CHUNK_SIZE)
+            if last_id is None:
+                break
+            after_id = last_id
+            updated += chunk_updated
+            bill_backfill.save_checkpoint(after_id)
+        else:
+            logger.info(f"Backfill updated {updated} bills up to id {after_id}; continuing")
+            backfill_bill_columns.delay(after_id)
+            return
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Bill backfill failed after id {after_id}: {str(e)}")
+        logger.error(traceback.format_exc())
+        return
+    finally:
+        db.close()
 
-def detect_paid_status(bill_text: str) -> bool:
-    paid_keywords = ["receipt", "payment confirmation", "קבלה", "אישור תשלום"]
-    return any(keyword.lower() in bill_text.lower() for keyword in paid_keywords)
+    logger.info(f"Backfill finished; updated {updated} bills in the last run")
+    bill_backfill.save_checkpoint(None)
+    bill_backfill.mark_done()
+    rebuild_bill_summaries.delay()
@@ -5,7 +5,6 @@ Run this script to verify Gmail API connectivity and permissions.
 
 import os
 import sys
-import requests
 from loguru import logger
 
 # Add backend directory to sys.path
@@ -14,7 +13,8 @@ os.chdir(os.path.dirname(os.path.abspath(__file__)))
 
 from app.database import SessionLocal
 from app.models import User
-from app.services.gmail_service import refresh_access_token
+from app.services.token_cache import get_access_token
+from app.services import http_client
 
 def check_gmail_api_permissions():
     """
@@ -42,15 +42,15 @@ def check_gmail_api_permissions():
                 
             try:
                 # Try to refresh the token
-                logger.info("Attempting to refresh access token...")
-                access_token = refresh_access_token(user.google_refresh_token)
-                logger.success("Successfully refreshed access token")
+                logger.info("Attempting to get access token...")
+                access_token = get_access_token(user.id, user.google_refresh_token)
+                logger.success("Successfully obtained access token")
                 
                 # Test basic Gmail API call
                 logger.info("Testing Gmail API access with basic metadata request...")
                 url = "https://gmail.googleapis.com/gmail/v1/users/me/profile"
                 headers = {"Authorization": f"Bearer {access_token}"}
-                resp = requests.get(url, headers=headers)
+                resp = http_client.get(url, headers=headers)
                 
                 if resp.ok:
                     profile = resp.json()
@@ -64,7 +64,7 @@ def check_gmail_api_permissions():
                 query = 'has:attachment OR subject:(bill OR invoice OR חשבונית OR קבלה)'
                 url = "https://gmail.googleapis.com/gmail/v1/users/me/messages"
                 params = {"q": query, "maxResults": 5}
-                resp = requests.get(url, params=params, headers=headers)
+                resp = http_client.get(url, params=params, headers=headers)
                 
                 if resp.ok:
                     data = resp.json()
@@ -2,41 +2,44 @@ import React from 'react';
 import { Box, Typography } from '@mui/material';
 import { ResponsiveContainer, BarChart, Bar, XAxis, YAxis, Tooltip, Legend, PieChart, Pie, Cell } from 'recharts';
 
-interface Bill {
-  date: string | null;
-  amount: number | null;
+// One row of /api/bills/summary
+export interface SummaryGroup {
+  month: string | null;
   category: string | null;
+  currency: string | null;
+  paid: boolean;
+  total: number;
+  count: number;
 }
 
 interface ChartsProps {
-  bills: Bill[];
+  summary: SummaryGroup[];
 }
 
 const COLORS = ['#8884d8', '#82ca9d', '#ffc658', '#ff7f50', '#87cefa'];
 
-const Charts: React.FC<ChartsProps> = ({ bills }) => {
+const Charts: React.FC<ChartsProps> = ({ summary }) => {
   const monthlyData: { month: string; total: number }[] = [];
-  bills.forEach(bill => {
-    if (bill.date && bill.amount !== null) {
-      const month = bill.date.substring(0, 7);
-      const item = monthlyData.find(d => d.month === month);
+  summary.forEach(group => {
+    if (group.month) {
+      const item = monthlyData.find(d => d.month === group.month);
       if (item) {
-        item.total += Number(bill.amount);
+        item.total += group.total;
       } else {
-        monthlyData.push({ month, total: Number(bill.amount) });
+        monthlyData.push({ month: group.month, total: group.total });
       }
     }
   });
   monthlyData.sort((a, b) => a.month.localeCompare(b.month));
 
   const categoryData: { category: string; total: number }[] = [];
-  bills.forEach(bill => {
-    if (bill.category && bill.amount !== null) {
-      const item = categoryData.find(d => d.category === bill.category);
+  summary.forEach(group => {
+    if (group.category) {
+      const item = categoryData.find(d => d.category === group.category);
       if (item) {
-        item.total += Number(bill.amount);
+        item.total += group.total;
       } else {
-        categoryData.push({ category: bill.category, total: Number(bill.amount) });
+        categoryData.push({ category: group.category, total: group.total });
       }
     }
   });
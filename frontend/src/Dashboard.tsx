@@ -1,8 +1,8 @@
-import React, { useEffect, useState, useContext } from 'react';
+import React, { useEffect, useRef, useState, useContext } from 'react';
 import { Container, Tabs, Tab, Box, Typography, Button, Grid } from '@mui/material';
-import { apiGet, apiPost } from './api';
-import Filters from './Filters';
-import Charts from './Charts';
+import { apiGet, apiGetPage, apiPost } from './api';
+import Filters, { BillFilters, EMPTY_FILTERS, filtersToQuery } from './Filters';
+import Charts, { SummaryGroup } from './Charts';
 import { AuthContext } from './App';
 
 interface Bill {
@@ -19,18 +19,60 @@ interface Bill {
 const Dashboard: React.FC = () => {
   const [bills, setBills] = useState<Bill[]>([]);
   const [tabValue, setTabValue] = useState(0);
+  const [filters, setFilters] = useState<BillFilters>(EMPTY_FILTERS);
   const [loading, setLoading] = useState(false);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [summary, setSummary] = useState<SummaryGroup[]>([]);
+  const [vendors, setVendors] = useState<string[]>([]);
+  const latestRequest = useRef(0);
   const { setUserInfo } = useContext(AuthContext);
 
+  const billsPath = (cursor: string | null = null) => {
+    const query = filtersToQuery(filters, tabValue === 1);
+    return `/api/bills?${query}${cursor ? `&cursor=${encodeURIComponent(cursor)}` : ''}`;
+  };
+
+  // Vendors seen so far, so narrowing the list doesn't shrink the vendor choices
+  const rememberVendors = (page: Bill[]) => {
+    setVendors(prev => Array.from(new Set([...prev, ...page.map(b => b.vendor).filter((v): v is string => !!v)])).sort());
+  };
+
   const fetchBills = async () => {
+    // A filter change restarts from the first page; ignore answers to older requests
+    const request = ++latestRequest.current;
     setLoading(true);
     try {
-      const data = await apiGet('/api/bills');
+      const { data, nextCursor } = await apiGetPage(billsPath());
+      if (request !== latestRequest.current) return;
       setBills(data);
+      setNextCursor(nextCursor);
+      rememberVendors(data);
     } catch (error) {
       console.error("Failed to fetch bills:", error);
     } finally {
-      setLoading(false);
+      if (request === latestRequest.current) setLoading(false);
+    }
+  };
+
+  const fetchSummary = async () => {
+    try {
+      setSummary(await apiGet('/api/bills/summary'));
+    } catch (error) {
+      console.error("Failed to fetch bill summary:", error);
+    }
+  };
+
+  const fetchMoreBills = async () => {
+    if (!nextCursor) return;
+    const request = latestRequest.current;
+    try {
+      const page = await apiGetPage(billsPath(nextCursor));
+      if (request !== latestRequest.current) return;
+      setBills(prev => [...prev, ...page.data]);
+      setNextCursor(page.nextCursor);
+      rememberVendors(page.data);
+    } catch (error) {
+      console.error("Failed to fetch more bills:", error);
     }
   };
 
@@ -53,7 +95,7 @@ const Dashboard: React.FC = () => {
     setLoading(true);
     try {
       await apiPost('/api/sync');
-      setTimeout(fetchBills, 5000);
+      setTimeout(() => { fetchBills(); fetchSummary(); }, 5000);
     } catch (error) {
       console.error("Sync failed:", error);
     } finally {
@@ -62,18 +104,20 @@ const Dashboard: React.FC = () => {
   };
 
   useEffect(() => {
-    fetchBills();
+    fetchSummary();
     ensureUserInfo();
   }, []);
 
+  useEffect(() => {
+    setNextCursor(null);
+    fetchBills();
+  }, [filters, tabValue]);
+
   const handleTabChange = (event: React.SyntheticEvent, newValue: number) => {
     setTabValue(newValue);
   };
 
-  const filteredBills = bills.filter(bill => {
-    if (tabValue === 0) return bill.status?.toLowerCase() !== "paid";
-    else return bill.status?.toLowerCase() === "paid";
-  });
+  const categories = Array.from(new Set(summary.map(group => group.category).filter((c): c is string => !!c))).sort();
 
   return (
     <Container maxWidth="lg" sx={{ mt: 4, px: { xs: 2, sm: 3, md: 4 } }}>
@@ -88,7 +132,7 @@ const Dashboard: React.FC = () => {
         </Grid>
       </Grid>
       <Box mt={2}>
-        <Filters bills={bills} onFilter={setBills} />
+        <Filters filters={filters} vendors={vendors} categories={categories} onChange={setFilters} />
       </Box>
       <Box sx={{ borderBottom: 1, borderColor: 'divider', mt: 2 }}>
         <Tabs value={tabValue} onChange={handleTabChange} aria-label="bill status tabs">
@@ -112,7 +156,7 @@ const Dashboard: React.FC = () => {
               </tr>
             </thead>
             <tbody>
-              {filteredBills.map(bill => (
+              {bills.map(bill => (
                 <tr key={bill.id} style={{ backgroundColor: bill.status?.toLowerCase() === 'paid' ? '#e0ffe0' : 'inherit' }}>
                   <td style={{ borderBottom: '1px solid #ddd', padding: '8px' }}>{bill.vendor || '-'}</td>
                   <td style={{ borderBottom: '1px solid #ddd', padding: '8px' }}>{bill.date || '-'}</td>
@@ -122,7 +166,7 @@ const Dashboard: React.FC = () => {
                   <td style={{ borderBottom: '1px solid #ddd', padding: '8px' }}>{bill.status || '-'}</td>
                 </tr>
               ))}
-              {filteredBills.length === 0 && (
+              {bills.length === 0 && (
                 <tr>
                   <td colSpan={6} style={{ textAlign: 'center', padding: '16px' }}>
                     No bills found.
@@ -132,9 +176,16 @@ const Dashboard: React.FC = () => {
             </tbody>
           </table>
         )}
+        {!loading && nextCursor && (
+          <Box mt={2} textAlign="center">
+            <Button variant="outlined" onClick={fetchMoreBills}>
+              Load more
+            </Button>
+          </Box>
+        )}
       </Box>
       <Box mt={4}>
-        <Charts bills={bills} />
+        <Charts summary={summary} />
       </Box>
     </Container>
   );
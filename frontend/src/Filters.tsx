@@ -1,40 +1,51 @@
 import React, { useState } from 'react';
 import { Box, TextField, FormControl, InputLabel, Select, MenuItem } from '@mui/material';
 
-// Make sure this Bill interface matches the one in Dashboard.tsx
-interface Bill {
-  id: number;
-  vendor: string | null;
-  date: string | null;
-  due_date: string | null;
-  amount: number | null;
-  currency: string | null;
-  category: string | null;
-  status: string | null;
+export interface BillFilters {
+  vendor: string;
+  category: string;
+  month: string;  // "YYYY-MM", "" for any month
+  amountMin: string;
+  amountMax: string;
+}
+
+export const EMPTY_FILTERS: BillFilters = { vendor: "", category: "", month: "", amountMin: "", amountMax: "" };
+
+const MONTH_PATTERN = /^\d{4}-(0[1-9]|1[0-2])$/;
+
+// Query string for /api/bills; the server does the filtering so every page matches
+export function filtersToQuery(filters: BillFilters, paid: boolean): string {
+  const params = new URLSearchParams({ paid: String(paid) });
+  if (filters.vendor) params.set('vendor', filters.vendor);
+  if (filters.category) params.set('category', filters.category);
+  if (MONTH_PATTERN.test(filters.month)) {
+    const [year, month] = filters.month.split('-').map(Number);
+    const lastDay = new Date(year, month, 0).getDate();
+    params.set('date_from', `${filters.month}-01`);
+    params.set('date_to', `${filters.month}-${String(lastDay).padStart(2, '0')}`);
+  }
+  if (filters.amountMin) params.set('amount_min', filters.amountMin);
+  if (filters.amountMax) params.set('amount_max', filters.amountMax);
+  return params.toString();
 }
 
 interface FiltersProps {
-  bills: Bill[];
-  onFilter: (filtered: Bill[]) => void;
+  filters: BillFilters;
+  vendors: string[];
+  categories: string[];
+  onChange: (filters: BillFilters) => void;
 }
 
-const Filters: React.FC<FiltersProps> = ({ bills, onFilter }) => {
-  const [vendor, setVendor] = useState("");
-  const [month, setMonth] = useState("");
-  const [category, setCategory] = useState("");
+const Filters: React.FC<FiltersProps> = ({ filters, vendors, categories, onChange }) => {
+  // Typed as it's edited, but only applied once it is empty or a whole month
+  const [month, setMonth] = useState(filters.month);
 
-  const vendors = Array.from(new Set(bills.map(b => b.vendor).filter((v): v is string => v !== null)));
-  const categories = Array.from(new Set(bills.map(b => b.category).filter(Boolean)));
+  const update = (changes: Partial<BillFilters>) => onChange({ ...filters, ...changes });
 
-  const handleFilterChange = React.useCallback(() => {
-    const filtered = bills.filter(b => {
-      const matchVendor = vendor ? b.vendor === vendor : true;
-      const matchCategory = category ? b.category === category : true;
-      const matchMonth = month ? (b.date && b.date.includes(month)) : true;
-      return matchVendor && matchCategory && matchMonth;
-    });
-    onFilter(filtered);
-  }, [bills, vendor, category, month, onFilter]);
+  const handleMonthChange = (value: string) => {
+    setMonth(value);
+    if (value === "" || MONTH_PATTERN.test(value)) update({ month: value });
+  };
 
   return (
     <Box sx={{ display: 'flex', gap: 2, flexWrap: 'wrap', mb: 2 }}>
@@ -43,18 +54,18 @@ const Filters: React.FC<FiltersProps> = ({ bills, onFilter }) => {
         variant="outlined"
         size="small"
         value={month}
-        onChange={(e) => { setMonth(e.target.value); handleFilterChange(); }}
+        onChange={(e) => handleMonthChange(e.target.value)}
       />
       <FormControl variant="outlined" size="small">
         <InputLabel>Vendor</InputLabel>
         <Select
           label="Vendor"
-          value={vendor}
-          onChange={(e) => { setVendor(e.target.value); handleFilterChange(); }}
+          value={filters.vendor}
+          onChange={(e) => update({ vendor: e.target.value })}
         >
           <MenuItem value=""><em>All</em></MenuItem>
           {vendors.map(v => (
-            <MenuItem key={v} value={v || ''}>{v || 'Unknown Vendor'}</MenuItem>
+            <MenuItem key={v} value={v}>{v}</MenuItem>
           ))}
         </Select>
       </FormControl>
@@ -62,15 +73,31 @@ const Filters: React.FC<FiltersProps> = ({ bills, onFilter }) => {
         <InputLabel>Category</InputLabel>
         <Select
           label="Category"
-          value={category}
-          onChange={(e) => { setCategory(e.target.value); handleFilterChange(); }}
+          value={filters.category}
+          onChange={(e) => update({ category: e.target.value })}
         >
           <MenuItem value=""><em>All</em></MenuItem>
           {categories.map(c => (
-            <MenuItem key={c || 'unknown'} value={c || ''}>{c || 'Unknown Category'}</MenuItem>
+            <MenuItem key={c} value={c}>{c}</MenuItem>
           ))}
         </Select>
       </FormControl>
+      <TextField
+        label="Min amount"
+        type="number"
+        variant="outlined"
+        size="small"
+        value={filters.amountMin}
+        onChange={(e) => update({ amountMin: e.target.value })}
+      />
+      <TextField
+        label="Max amount"
+        type="number"
+        variant="outlined"
+        size="small"
+        value={filters.amountMax}
+        onChange={(e) => update({ amountMax: e.target.value })}
+      />
     </Box>
   );
 };
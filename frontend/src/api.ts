@@ -27,6 +27,33 @@ export async function apiGet(path: string) {
   }
 }
 
+// GET a paginated listing; the cursor for the next page comes back in X-Next-Cursor
+export async function apiGetPage(path: string): Promise<{ data: any; nextCursor: string | null }> {
+  const token = localStorage.getItem('token');
+  try {
+    const res = await fetch(`${API_BASE}${path}`, {
+      headers: {
+        'Authorization': token ? `Bearer ${token}` : ''
+      }
+    });
+
+    if (res.status === 401) {
+      localStorage.removeItem('token');
+      window.location.href = '/login';
+      throw new Error('Authentication failed - please login again');
+    }
+
+    if (!res.ok) {
+      throw new Error(`API GET failed: ${res.status}`);
+    }
+
+    return { data: await res.json(), nextCursor: res.headers.get('X-Next-Cursor') };
+  } catch (error) {
+    console.error(`API error (GET ${path}):`, error);
+    throw error;
+  }
+}
+
 export async function apiPost(path: string, body: any = null) {
   const token = localStorage.getItem('token');
   try {